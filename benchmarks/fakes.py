@@ -0,0 +1,275 @@
+"""Локальные заглушки REST API Gitlab и Mattermost для бенчмарков.
+
+Каждая заглушка - HTTP-сервер в отдельном потоке с настраиваемой задержкой ответа, долей ошибок и счетчиками
+вызовов по маршрутам. Реализованы только эндпоинты, которые использует сервис.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yaml
+
+
+class FakeService:
+    """HTTP-сервер с маршрутами ROUTES: (метод, регулярное выражение пути, имя маршрута, имя обработчика).
+
+    Обработчик получает (match, query, body) и возвращает (status, payload, headers).
+    Перед ответом выдерживается latency + random(0, jitter) сек, доля error_rate запросов завершается error_status.
+    """
+
+    ROUTES: list[tuple[str, str, str, str]] = []
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls: Counter = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._routes = [(method, re.compile(pattern), name, getattr(self, handler))
+                        for method, pattern, name, handler in self.ROUTES]
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "FakeService":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeService":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def call_counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(sorted(self.calls.items()))
+
+    def _handle(self, method: str, raw_path: str, body: bytes) -> tuple[int, object, dict]:
+        parts = urlsplit(raw_path)
+        for route_method, pattern, name, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(parts.path)
+            if not match:
+                continue
+            with self._lock:
+                self.calls[name] += 1
+                failed = self._random.random() < self.error_rate
+                delay = self.latency + self._random.uniform(0, self.jitter)
+            if delay:
+                time.sleep(delay)
+            if failed:
+                with self._lock:
+                    self.calls["injected_errors"] += 1
+                return self.error_status, {"message": "injected error"}, {}
+            query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            payload = json.loads(body) if body else None
+            return handler(match, query, payload)
+        with self._lock:
+            self.calls["not_found"] += 1
+        return 404, {"message": f"{method} {parts.path} not found"}, {}
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело отправляются отдельно: без TCP_NODELAY каждый ответ ждет delayed ACK клиента
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload, headers = service._handle(method, self.path, body)
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", headers.pop("Content-Type", "application/json"))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", "0" if method == "HEAD" else str(len(data)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_HEAD(self):
+                self._respond("HEAD")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def do_PUT(self):
+                self._respond("PUT")
+
+        return Handler
+
+
+_PROJECT = r"^/api/v4/projects/(?P<project>[^/]+)"
+_MR = _PROJECT + r"/merge_requests/(?P<iid>\d+)"
+
+
+class FakeGitlab(FakeService):
+    """Gitlab с конфигурацией из teams команд по users_per_team участников (user0, user1, ...) и MR,
+    содержащими files_per_mr измененных файлов. Автор MR iid - участник с номером iid по кругу."""
+
+    ROUTES = [
+        ("GET", r"^/api/v4/user$", "auth", "_auth"),
+        ("GET", r"^/api/v4/users$", "users", "_users"),
+        ("HEAD", _PROJECT + r"/repository/files/(?P<file>[^/]+)$", "config_head", "_config_head"),
+        ("GET", _PROJECT + r"/repository/files/(?P<file>[^/]+)/raw$", "config_raw", "_config_raw"),
+        ("GET", _PROJECT + r"$", "project", "_project"),
+        ("GET", _MR + r"$", "mr", "_mr"),
+        ("GET", _MR + r"/diffs$", "mr_diffs", "_mr_diffs"),
+        ("GET", _MR + r"/changes$", "mr_changes", "_mr_changes"),
+        ("POST", _MR + r"/discussions$", "mr_discussion", "_mr_discussion"),
+        ("PUT", _MR + r"$", "mr_update", "_mr_update"),
+    ]
+
+    def __init__(self, teams: int = 10, users_per_team: int = 10, reviewers_per_team: int = 5, files_per_mr: int = 10,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.files_per_mr = files_per_mr
+        self.usernames = [f"user{i}" for i in range(teams * users_per_team)]
+        self._notes = 0
+        self.config = {
+            "teams": [{f"team{t}": {
+                "lead": self.usernames[t * users_per_team],
+                "channel": f"channel{t}",
+                "quantity": 2,
+                "members": self.usernames[t * users_per_team:(t + 1) * users_per_team],
+                "reviewers": self.usernames[t * users_per_team:t * users_per_team + reviewers_per_team],
+            }} for t in range(teams)],
+            "projects": {"override": [], "exclude": ["bench/excluded"],
+                         "skip": {"extensions": ["lock"], "files": [".gitlab-ci.yml"]}},
+        }
+        self._publish_config()
+
+    def _publish_config(self):
+        self.config_text = yaml.safe_dump(self.config).encode()
+        self.config_sha256 = hashlib.sha256(self.config_text).hexdigest()
+
+    def bump_config(self):
+        """Изменяет одну команду, как при правке конфигурации в репозитории."""
+        team = next(iter(self.config["teams"][0].values()))
+        team["quantity"] = 3 - team["quantity"]
+        self._publish_config()
+
+    def user(self, username: str) -> dict:
+        user_id = int(username[4:]) + 100
+        return {"id": user_id, "username": username, "name": username.title(), "state": "active",
+                "avatar_url": f"{self.url}/avatar/{user_id}.png", "web_url": f"{self.url}/{username}"}
+
+    def _project_attrs(self, project: str) -> dict:
+        project = unquote(project)
+        project_id = int(project) if project.isdigit() else 1
+        path = project if not project.isdigit() else f"bench/project{project_id}"
+        return {"id": project_id, "path_with_namespace": path, "web_url": f"{self.url}/{path}"}
+
+    def _mr_attrs(self, project: str, iid: int) -> dict:
+        attrs = self._project_attrs(project)
+        author = self.user(self.usernames[iid % len(self.usernames)])
+        return {"id": attrs["id"] * 100000 + iid, "iid": iid, "project_id": attrs["id"], "state": "opened",
+                "title": f"MR {iid}", "labels": [], "reviewers": [], "author": author, "assignee": author,
+                "source_branch": f"feature-{iid}", "target_branch": "master",
+                "web_url": f"{attrs['web_url']}/-/merge_requests/{iid}",
+                "references": {"full": f"{attrs['path_with_namespace']}!{iid}"},
+                "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+
+    def _diffs(self) -> list[dict]:
+        return [{"new_path": f"src/module{i}/file{i}.py", "diff": "+line\n" * (i + 1)} for i in range(self.files_per_mr)]
+
+    def _auth(self, match, query, body):
+        return 200, {"id": 1, "username": "review-bot"}, {}
+
+    def _users(self, match, query, body):
+        username = query.get("username", "")
+        return 200, [self.user(username)] if username in self.usernames else [], {}
+
+    def _config_head(self, match, query, body):
+        return 200, b"", {"X-Gitlab-Content-Sha256": self.config_sha256}
+
+    def _config_raw(self, match, query, body):
+        return 200, self.config_text, {"Content-Type": "text/plain"}
+
+    def _project(self, match, query, body):
+        return 200, self._project_attrs(match["project"]), {}
+
+    def _mr(self, match, query, body):
+        return 200, self._mr_attrs(match["project"], int(match["iid"])), {}
+
+    def _mr_diffs(self, match, query, body):
+        return 200, self._diffs(), {}
+
+    def _mr_changes(self, match, query, body):
+        return 200, {**self._mr_attrs(match["project"], int(match["iid"])), "changes": self._diffs()}, {}
+
+    def _mr_discussion(self, match, query, body):
+        with self._lock:
+            self._notes += 1
+            note_id = self._notes
+        return 201, {"id": f"discussion{note_id}", "notes": [{"id": note_id, "body": (body or {}).get("body")}]}, {}
+
+    def _mr_update(self, match, query, body):
+        return 200, {**self._mr_attrs(match["project"], int(match["iid"])), **(body or {})}, {}
+
+
+class FakeMattermost(FakeService):
+    """Mattermost, в котором существует любой пользователь: id пользователя - "id-<username>"."""
+
+    ROUTES = [
+        ("GET", r"^/api/v4/users/me$", "login", "_me"),
+        ("GET", r"^/api/v4/users/username/(?P<username>[^/]+)$", "user", "_user"),
+        ("POST", r"^/api/v4/users/usernames$", "users", "_users"),
+        ("POST", r"^/api/v4/channels/direct$", "direct_channel", "_direct_channel"),
+        ("POST", r"^/api/v4/posts$", "post", "_post"),
+    ]
+
+    @staticmethod
+    def _user_attrs(username: str) -> dict:
+        return {"id": f"id-{username}", "username": username, "email": f"{username}@example.com"}
+
+    def _me(self, match, query, body):
+        return 200, self._user_attrs("review-bot"), {}
+
+    def _user(self, match, query, body):
+        return 200, self._user_attrs(unquote(match["username"])), {}
+
+    def _users(self, match, query, body):
+        return 200, [self._user_attrs(username) for username in body or []], {}
+
+    def _direct_channel(self, match, query, body):
+        return 201, {"id": "dm-" + "-".join(sorted(body or []))}, {}
+
+    def _post(self, match, query, body):
+        return 201, {"id": f"post-{time.monotonic_ns()}", **(body or {})}, {}
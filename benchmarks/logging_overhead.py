@@ -0,0 +1,96 @@
+"""Стоимость логирования на один запрос /review при LOG_LEVEL=INFO и DEBUG, текстовом и JSON-формате.
+
+Запросы обрабатываются последовательно на заглушках Gitlab и Mattermost без задержки (benchmarks/fakes.py),
+логи пишутся в /dev/null. Накладные расходы - разница медиан с запуском без обработчиков логов.
+
+Запуск: python -m benchmarks.logging_overhead --requests 300
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from loguru import logger as log
+
+from reviewer.config import LogFormat
+from reviewer.dispatcher import Dispatcher
+from reviewer.idempotency import ReviewLedger
+from reviewer.logs import setup_logging
+from reviewer.services import TeamService, GitService, ReviewService
+from reviewer.teams import Git, Team, ReviewLoad
+from .fakes import FakeGitlab, FakeMattermost
+from .suite import build_config, build_bot, build_outbox, percentile
+
+MODES = (("off", None, None), ("INFO", "INFO", LogFormat.TEXT), ("DEBUG", "DEBUG", LogFormat.TEXT),
+         ("INFO json", "INFO", LogFormat.JSON), ("DEBUG json", "DEBUG", LogFormat.JSON))
+
+
+def build_service(gitlab: FakeGitlab, mattermost: FakeMattermost, workdir: Path) -> ReviewService:
+    cfg = build_config(SimpleNamespace(concurrency=1, retries=0, backoff=0, outbox_backoff=1),
+                       gitlab, mattermost, workdir)
+    git = Git(cfg)
+    team = Team(git=git, load=ReviewLoad(path=cfg.REVIEW_LOAD_PATH))
+    team.update_config()
+    outbox = build_outbox(cfg)
+    dispatcher = Dispatcher(outbox, build_bot(cfg), concurrency=1, poll_interval=1)
+    return ReviewService(TeamService(team=team), GitService(git=git), outbox, dispatcher,
+                         ledger=ReviewLedger(path=cfg.REVIEW_LEDGER_PATH, ttl=cfg.REVIEW_CACHE_TTL))
+
+
+def blocks(total: int, block: int) -> list[int]:
+    """Размеры блоков для total запросов: по block, последний - остаток."""
+    return [min(block, total - start) for start in range(0, total, block)]
+
+
+async def run(args, gitlab: FakeGitlab, mattermost: FakeMattermost, sink, workdir: Path) -> dict[str, list[float]]:
+    """Режимы чередуются блоками по block запросов, чтобы дрейф производительности не искажал сравнение.
+    Сначала выполняются warmup запросов без замера, затем ровно requests замеряемых на каждый режим."""
+    log.remove()
+    services = {name: build_service(gitlab, mattermost, workdir / str(i)) for i, (name, _, _) in enumerate(MODES)}
+    latencies = {name: [] for name, _, _ in MODES}
+    mr_id = 0
+    schedule = [(size, False) for size in blocks(args.warmup, args.block)] + \
+               [(size, True) for size in blocks(args.requests, args.block)]
+    for size, measured in schedule:
+        for name, level, log_format in MODES:
+            if level:
+                setup_logging(level=level, log_format=log_format, rate_limit=0, sink=sink)
+            else:
+                log.remove()
+            for _ in range(size):
+                mr_id += 1
+                start = time.perf_counter()
+                await services[name].review(project_id=1, mr_id=mr_id)
+                if measured:
+                    latencies[name].append(time.perf_counter() - start)
+    log.remove()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300, help="Запросов на каждый режим")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--block", type=int, default=10, help="Запросов подряд в одном режиме")
+    parser.add_argument("--files", type=int, default=50, help="Измененных файлов в MR (размер отладочного вывода)")
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as sink, tempfile.TemporaryDirectory(prefix="bench-logging-") as workdir, \
+            FakeGitlab(files_per_mr=args.files) as gitlab, FakeMattermost() as mattermost:
+        latencies = asyncio.run(run(args, gitlab, mattermost, sink, Path(workdir)))
+
+    baseline = None
+    for name, values in latencies.items():
+        p50_us = percentile(values, 50) * 1e6
+        baseline = p50_us if baseline is None else baseline
+        print({"mode": name, "requests": len(values), "p50_us": round(p50_us, 1),
+               "p99_us": round(percentile(values, 99) * 1e6, 1),
+               "mean_us": round(sum(values) / len(values) * 1e6, 1),
+               "logging_overhead_us": round(p50_us - baseline, 1)})
+
+
+if __name__ == "__main__":
+    main()
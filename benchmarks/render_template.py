@@ -0,0 +1,38 @@
+"""Стоимость одного рендеринга шаблона: новое окружение Jinja на каждый вызов против кэша скомпилированных шаблонов.
+
+Запуск: python -m benchmarks.render_template --number 2000
+"""
+import argparse
+import timeit
+
+from jinja2 import Environment, FileSystemLoader
+
+from reviewer.utilites import TEMPLATES_DIR, precompile_templates, render_template
+
+CONTEXT = {
+    "mr_author_username": "author",
+    "mr_web_url": "https://git.example.com/group/project/-/merge_requests/1",
+    "reviewer_username": "reviewer",
+    "reviewer_lead": "lead",
+}
+
+
+def render_uncached(template_filename: str, context: dict) -> str:
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True)
+    return env.get_template(template_filename).render(context)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--template", default="git-mr-thread-body.j2")
+    args = parser.parse_args()
+
+    precompile_templates()
+    for name, func in (("uncached", render_uncached), ("cached", render_template)):
+        seconds = timeit.timeit(lambda: func(args.template, CONTEXT), number=args.number)
+        print({"mode": name, "renders": args.number, "us_per_render": round(seconds / args.number * 1e6, 1)})
+
+
+if __name__ == "__main__":
+    main()
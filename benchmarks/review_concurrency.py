@@ -0,0 +1,139 @@
+"""Сравнение пропускной способности /review: блокирующие вызовы Gitlab в event loop против пула потоков.
+
+Запуск: python -m benchmarks.review_concurrency --concurrency 20 --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from loguru import logger as log
+
+from reviewer.config import DiffMode
+from reviewer.services import GitService
+from reviewer.teams import Git
+from reviewer.teams.matchers import SkipMatcher
+from reviewer.teams.schemas import GitUser, Group
+
+
+class FakeMr(SimpleNamespace):
+    def __init__(self, latency: float, iid: int):
+        super().__init__(
+            iid=iid, state="opened", labels=[], reviewers=[], title="MR", web_url="https://git.example.com/p/-/merge_requests/1",
+            source_branch="feature", target_branch="master", created_at="2024-01-01T00:00:00Z",
+            updated_at="2024-01-01T00:00:00Z", references={"full": f"group/project!{iid}"},
+            author={"username": "author", "avatar_url": "https://git.example.com/a.png", "web_url": "https://git.example.com/author"},
+            assignee={"avatar_url": "https://git.example.com/r.png", "web_url": "https://git.example.com/reviewer"},
+        )
+        self._latency = latency
+        self.discussions = SimpleNamespace(create=self._create_discussion)
+
+    def changes(self):
+        time.sleep(self._latency)
+        return {"changes": [{"diff": "+line\n", "new_path": "src/main.py"}]}
+
+    def _create_discussion(self, data):
+        time.sleep(self._latency)
+        return SimpleNamespace(attributes={"notes": [{"id": 1}]})
+
+    def save(self):
+        time.sleep(self._latency)
+        return True
+
+
+class FakeGitlab:
+    def __init__(self, latency: float):
+        self._latency = latency
+        self.projects = SimpleNamespace(get=self._get_project)
+
+    def _get_project(self, project_id, lazy=False):
+        time.sleep(self._latency)
+        latency = self._latency
+
+        def get_mr(mr_id):
+            time.sleep(latency)
+            return FakeMr(latency, mr_id)
+
+        return SimpleNamespace(id=project_id, path_with_namespace="group/project", web_url="https://git.example.com/group/project",
+                               mergerequests=SimpleNamespace(get=get_mr))
+
+
+def build_git(latency: float, workers: int) -> Git:
+    git = Git.__new__(Git)
+    git.cfg = SimpleNamespace(DEBUG_REVIEWER_ID=None, GITLAB_DIFF_MODE=DiffMode.FULL)
+    git.gl = FakeGitlab(latency)
+    git.config = {"projects": {"skip": {"extensions": [], "files": []}}}
+    git.skip = SkipMatcher()
+    git._executor = ThreadPoolExecutor(max_workers=workers)
+    return git
+
+
+REVIEWER = GitUser(id=2, name="Reviewer", uname="reviewer")
+AUTHOR = GitUser(id=1, name="Author", uname="author")
+TEAM = Group(name="team", quantity=1, reviewers=[REVIEWER])
+
+
+async def review_blocking(git: Git, mr_id: int) -> bool:
+    mr, project = git.get_mr_info(1, mr_id)
+    diffs = git.get_commits_info(mr)
+    return git.set_mr_review_setting([REVIEWER.copy()], AUTHOR, TEAM, None, mr, project, diffs) is not None
+
+
+async def review_executor(service: GitService, mr_id: int) -> bool:
+    mr, project = await service.get_mr(project_id=1, mr_id=mr_id)
+    diffs = await service.get_commit_info(mr)
+    return await service.set_mr_review_setting([REVIEWER.copy()], AUTHOR, TEAM, None, mr, project, diffs) is not None
+
+
+async def probe_health(stop: asyncio.Event, delays: list[float]):
+    """Имитирует /health: измеряет задержку планирования корутины в event loop."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        delays.append(time.perf_counter() - start - 0.01)
+
+
+async def run(mode: str, concurrency: int, total: int, latency: float) -> dict:
+    git = build_git(latency, concurrency)
+    service = GitService(git=git)
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    delays: list[float] = []
+    probe = asyncio.create_task(probe_health(stop, delays))
+
+    async def one(mr_id: int) -> bool:
+        async with semaphore:
+            if mode == "blocking":
+                return await review_blocking(git, mr_id)
+            return await review_executor(service, mr_id)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return {"mode": mode, "requests": total, "failed": results.count(False), "seconds": round(elapsed, 3),
+            "rps": round(total / elapsed, 1), "health_max_delay_ms": round(max(delays, default=0) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка одного вызова Gitlab, сек")
+    args = parser.parse_args()
+    log.remove()
+
+    failed = 0
+    for mode in ("blocking", "executor"):
+        result = asyncio.run(run(mode, args.concurrency, args.requests, args.latency))
+        failed += result["failed"]
+        print(result)
+    # set_mr_review_setting возвращает None при любой ошибке: без проверки сломанная заглушка дает ложные цифры
+    if failed:
+        raise SystemExit(f"Настройка ревью завершилась ошибкой для {failed} запросов, результаты недействительны")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Воспроизводимый набор бенчмарков на локальных заглушках Gitlab и Mattermost (benchmarks/fakes.py).
+
+Сценарии:
+  config_load - загрузка конфигурации из teams команд по users участников: холодная, после правки, без изменений
+  review      - настройка код-ревью requests MR при concurrency параллельных запросах (ReviewService.review)
+  drain       - отправка notifications уведомлений из outbox диспетчером
+
+Для каждого сценария записываются p50/p99 задержки и количество вызовов заглушек в JSON-файл.
+Результаты двух запусков (например, до и после изменения) сравниваются через --compare.
+
+Запуск:
+  python -m benchmarks.suite --latency 0.01 --output bench.json
+  python -m benchmarks.suite --scenario review --concurrency 16 --error-rate 0.05 --output bench.json
+  python -m benchmarks.suite --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from fastapi import HTTPException
+from loguru import logger as log
+
+from reviewer.bot import Bot
+from reviewer.bot.client import SessionClient
+from reviewer.config import InitConfig
+from reviewer.dispatcher import Dispatcher
+from reviewer.idempotency import ReviewLedger
+from reviewer.outbox import Outbox
+from reviewer.services import TeamService, GitService, ReviewService
+from reviewer.teams import Git, Team, ReviewLoad
+from reviewer.teams.schemas import GitUser, MrCrResultData, MrDiffList, MrDiff
+from .fakes import FakeGitlab, FakeMattermost
+
+SCENARIOS = ("config_load", "review", "drain")
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Процентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def summarize(seconds: list[float]) -> dict:
+    return {"count": len(seconds),
+            "p50_ms": round(percentile(seconds, 50) * 1000, 2),
+            "p99_ms": round(percentile(seconds, 99) * 1000, 2),
+            "max_ms": round(max(seconds, default=0) * 1000, 2),
+            "mean_ms": round(sum(seconds) / len(seconds) * 1000, 2) if seconds else 0.0}
+
+
+def build_config(args, gitlab: FakeGitlab, mattermost: FakeMattermost, workdir: Path) -> InitConfig:
+    return InitConfig.parse_obj({
+        "GITLAB_URL": gitlab.url,
+        "GITLAB_TOKEN": "bench",
+        "MM_TOKEN": "bench",
+        "MM_HOST": "127.0.0.1",
+        "MM_PORT": mattermost.port,
+        "MM_DISPATCH_CONCURRENCY": args.concurrency,
+        "MM_BOT_MSG_INTERVAL": 1,
+        "TEAM_CONFIG_PROJECT": "bench/config",
+        "TEAM_SNAPSHOT_PATH": str(workdir / "team-snapshot.json"),
+        "OUTBOX_PATH": str(workdir / "outbox.sqlite3"),
+        "OUTBOX_BACKOFF_BASE": args.outbox_backoff,
+        "REVIEW_LEDGER_PATH": str(workdir / "reviews.sqlite3"),
+        "REVIEW_LOAD_PATH": str(workdir / "review-load.sqlite3"),
+        "GITLAB_IO_WORKERS": max(args.concurrency, 16),
+        "HTTP_POOL_SIZE": max(args.concurrency, 20),
+        "HTTP_RETRIES": args.retries,
+        "HTTP_BACKOFF_FACTOR": args.backoff,
+        "LOG_LEVEL": "ERROR",
+    })
+
+
+def build_bot(cfg: InitConfig) -> Bot:
+    """Bot, подключенный к заглушке по http и порту MM_PORT (в рабочем режиме используется https:443)."""
+    bot = Bot(cfg)
+    bot._cfg = bot._cfg.copy(update={"scheme": "http", "port": cfg.MM_PORT})
+    bot._link = type(bot._link)({**bot._cfg.dict(), "session": bot.session}, client_cls=SessionClient)
+    return bot
+
+
+def build_outbox(cfg: InitConfig, cls: type[Outbox] = Outbox) -> Outbox:
+    return cls(path=cfg.OUTBOX_PATH, max_attempts=cfg.OUTBOX_MAX_ATTEMPTS, backoff_base=cfg.OUTBOX_BACKOFF_BASE,
+               backoff_max=cfg.OUTBOX_BACKOFF_MAX)
+
+
+class TimedOutbox(Outbox):
+    """Outbox, запоминающий время подтверждения отправки каждого элемента."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acked_at: list[float] = []
+
+    def ack(self, item_id: int):
+        super().ack(item_id)
+        self.acked_at.append(time.perf_counter())
+
+
+def run_config_load(args, gitlab: FakeGitlab, mattermost: FakeMattermost, workdir: Path) -> dict:
+    cfg = build_config(args, gitlab, mattermost, workdir)
+    cold, changed, unchanged = [], [], []
+    calls = {}
+    for _ in range(args.rounds):
+        team = Team(git=Git(cfg))
+        gitlab.reset_calls()
+        start = time.perf_counter()
+        team.update_config()
+        cold.append(time.perf_counter() - start)
+        calls["cold"] = gitlab.call_counts()
+
+        gitlab.bump_config()
+        gitlab.reset_calls()
+        start = time.perf_counter()
+        team.update_config()
+        changed.append(time.perf_counter() - start)
+        calls["changed"] = gitlab.call_counts()
+
+        gitlab.reset_calls()
+        start = time.perf_counter()
+        team.update_config()
+        unchanged.append(time.perf_counter() - start)
+        calls["unchanged"] = gitlab.call_counts()
+    return {"params": {"teams": args.teams, "users_per_team": args.users, "rounds": args.rounds},
+            "cold": summarize(cold), "changed": summarize(changed), "unchanged": summarize(unchanged),
+            "calls": {"gitlab": calls}}
+
+
+async def _run_review(args, cfg: InitConfig, gitlab: FakeGitlab) -> dict:
+    git = Git(cfg)
+    team = Team(git=git, load=ReviewLoad(path=cfg.REVIEW_LOAD_PATH))
+    team.update_config()
+    outbox = build_outbox(cfg)
+    dispatcher = Dispatcher(outbox, build_bot(cfg), concurrency=cfg.MM_DISPATCH_CONCURRENCY, poll_interval=1)
+    service = ReviewService(TeamService(team=team), GitService(git=git), outbox, dispatcher,
+                            ledger=ReviewLedger(path=cfg.REVIEW_LEDGER_PATH, ttl=cfg.REVIEW_CACHE_TTL))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, statuses = [], {}
+
+    async def one(mr_id: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await service.review(project_id=1, mr_id=mr_id)
+                status = 200
+            except HTTPException as ex:
+                status = ex.status_code
+            except Exception:
+                status = 500
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    gitlab.reset_calls()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(mr_id) for mr_id in range(1, args.requests + 1)))
+    elapsed = time.perf_counter() - start
+    return {"params": {"requests": args.requests, "concurrency": args.concurrency},
+            "latency": summarize(latencies), "seconds": round(elapsed, 3), "rps": round(args.requests / elapsed, 1),
+            "statuses": dict(sorted(statuses.items())), "calls": {"gitlab": gitlab.call_counts()}}
+
+
+def run_review(args, gitlab: FakeGitlab, mattermost: FakeMattermost, workdir: Path) -> dict:
+    return asyncio.run(_run_review(args, build_config(args, gitlab, mattermost, workdir), gitlab))
+
+
+def _notification(gitlab: FakeGitlab, number: int) -> MrCrResultData:
+    reviewers = [GitUser(**{**gitlab.user(name), "uname": name, "thread_id": number})
+                 for name in gitlab.usernames[number % len(gitlab.usernames):][:2]]
+    author = GitUser(id=1, name="Author", uname="author")
+    mr_url = f"{gitlab.url}/bench/project1/-/merge_requests/{number}"
+    return MrCrResultData(review_team="team0", review_lead=author, review_channel=f"channel{number % 4}",
+                          project_name=f"bench/project1!{number}", project_id=1, web_url=f"{gitlab.url}/bench/project1",
+                          source_branch="feature", target_branch="master", mr_reviewers=reviewers,
+                          mr_reviewer_avatar=f"{gitlab.url}/r.png", mr_reviewer_url=f"{gitlab.url}/reviewer",
+                          mr_author=author, mr_author_avatar=f"{gitlab.url}/a.png", mr_author_url=f"{gitlab.url}/author",
+                          mr_id=str(number), mr_url=mr_url, mr_title=f"MR {number}",
+                          mr_diffs=MrDiffList(diffs=[MrDiff(new_path="src/main.py", diff_size=10)]),
+                          created_at=datetime(2024, 1, 1), updated_at=datetime(2024, 1, 1))
+
+
+async def _run_drain(args, cfg: InitConfig, gitlab: FakeGitlab, mattermost: FakeMattermost) -> dict:
+    outbox: TimedOutbox = build_outbox(cfg, TimedOutbox)
+    for number in range(args.notifications):
+        outbox.put(_notification(gitlab, number))
+    dispatcher = Dispatcher(outbox, build_bot(cfg), concurrency=cfg.MM_DISPATCH_CONCURRENCY,
+                            poll_interval=cfg.MM_BOT_MSG_INTERVAL)
+
+    mattermost.reset_calls()
+    start = time.perf_counter()
+    task = asyncio.create_task(dispatcher.run())
+    deadline = start + args.drain_timeout
+    while outbox.depth() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await dispatcher.stop()
+    return {"params": {"notifications": args.notifications, "concurrency": cfg.MM_DISPATCH_CONCURRENCY},
+            "latency": summarize([acked - start for acked in outbox.acked_at]), "seconds": round(elapsed, 3),
+            "delivered": len(outbox.acked_at), "pending": outbox.depth(), "dead_letters": outbox.dead_count(),
+            "calls": {"mattermost": mattermost.call_counts()}}
+
+
+def run_drain(args, gitlab: FakeGitlab, mattermost: FakeMattermost, workdir: Path) -> dict:
+    return asyncio.run(_run_drain(args, build_config(args, gitlab, mattermost, workdir), gitlab, mattermost))
+
+
+RUNNERS = {"config_load": run_config_load, "review": run_review, "drain": run_drain}
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    fake_params = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+                   "error_status": args.error_status, "seed": args.seed}
+    result = {"commit": _commit(), "created_at": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "fakes": fake_params, "scenarios": {}}
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    for name in scenarios:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir, \
+                FakeGitlab(teams=args.teams, users_per_team=args.users, files_per_mr=args.files, **fake_params) \
+                as gitlab, FakeMattermost(**fake_params) as mattermost:
+            result["scenarios"][name] = RUNNERS[name](args, gitlab, mattermost, Path(workdir))
+        print(name, json.dumps(result["scenarios"][name], ensure_ascii=False))
+    return result
+
+
+def _latencies(scenario: dict, prefix: str = "") -> dict[str, dict]:
+    found = {}
+    for key, value in scenario.items():
+        if isinstance(value, dict) and "p50_ms" in value:
+            found[prefix + key] = value
+    return found
+
+
+def compare(before_path: str, after_path: str):
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for name, scenario in after["scenarios"].items():
+        previous = before["scenarios"].get(name)
+        if not previous:
+            continue
+        for metric, value in _latencies(scenario).items():
+            old = _latencies(previous).get(metric)
+            if not old:
+                continue
+            for key in ("p50_ms", "p99_ms"):
+                change = (value[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                print(f"{name}.{metric}.{key}: {old[key]} -> {value[key]} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("all", *SCENARIOS), default="all")
+    parser.add_argument("--output", help="Файл для записи результатов (JSON)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Сравнить два файла результатов")
+    parser.add_argument("--latency", type=float, default=0.005, help="Задержка ответа заглушек, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов, завершающихся ошибкой")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP-статус внедряемых ошибок")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--retries", type=int, default=3, help="HTTP_RETRIES")
+    parser.add_argument("--backoff", type=float, default=0.05, help="HTTP_BACKOFF_FACTOR")
+    parser.add_argument("--teams", type=int, default=10)
+    parser.add_argument("--users", type=int, default=10, help="Участников в команде")
+    parser.add_argument("--files", type=int, default=10, help="Измененных файлов в MR")
+    parser.add_argument("--rounds", type=int, default=5, help="Повторов сценария config_load")
+    parser.add_argument("--requests", type=int, default=200, help="MR в сценарии review")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--notifications", type=int, default=200, help="Уведомлений в сценарии drain")
+    parser.add_argument("--outbox-backoff", type=int, default=1, help="OUTBOX_BACKOFF_BASE для сценария drain")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    args = parser.parse_args()
+    log.remove()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = run(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2))
+        print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,198 @@
+import asyncio
 import logging
-import sys
-from queue import Queue
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from fastapi_utils.tasks import repeat_every
 from loguru import logger as log
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from .bot import Bot
 from .config import init_environment
-from .teams import Git, Team
+from .dispatcher import Dispatcher
+from .idempotency import ReviewLedger
+from .logs import setup_logging, request_id
+from .outbox import Outbox
+from .readiness import Readiness
+from .metrics import StateCollector
+from .profiling import SamplingProfiler
+from .tracing import init_tracing, transaction, mark_failed, UNTRACED_PATHS
+from .services import TeamService, GitService, ReviewService
+from .teams import Git, Team, ConfigSync, ReviewLoad
+from .utilites import precompile_templates
 
 init_config = init_environment()
+readiness = Readiness("gitlab", "config")
 
-msg_queue = Queue()
-msg_error_queue = Queue()
+outbox = Outbox(path=init_config.OUTBOX_PATH,
+                max_attempts=init_config.OUTBOX_MAX_ATTEMPTS,
+                backoff_base=init_config.OUTBOX_BACKOFF_BASE,
+                backoff_max=init_config.OUTBOX_BACKOFF_MAX)
 
-log.remove()
-log.add(sys.stderr, level=logging.getLevelName(init_config.LOG_LEVEL))
+setup_logging(level=logging.getLevelName(init_config.LOG_LEVEL),
+              log_format=init_config.LOG_FORMAT,
+              rate_limit=init_config.LOG_RATE_LIMIT)
 log.info(f"Уровень логирования выставлен на {init_config.LOG_LEVEL}")
+log.info(f"Шаблоны сообщений скомпилированы: {precompile_templates()}")
+
+init_tracing(dsn=init_config.SENTRY_DSN,
+             sample_rate=init_config.SENTRY_TRACES_SAMPLE_RATE,
+             slow_threshold=init_config.TRACES_SLOW_THRESHOLD,
+             otlp_file=init_config.TRACES_OTLP_FILE)
+
+bot = Bot(init_config)
+git = Git(init_config)
+team = Team(git=git, load=ReviewLoad(path=init_config.REVIEW_LOAD_PATH))
+config_sync = ConfigSync(team, path=init_config.TEAM_SNAPSHOT_PATH)
+dispatcher = Dispatcher(outbox, bot,
+                        concurrency=init_config.MM_DISPATCH_CONCURRENCY,
+                        poll_interval=init_config.MM_BOT_MSG_INTERVAL)
+review_service = ReviewService(TeamService(team=team), GitService(git=git), outbox, dispatcher,
+                               ledger=ReviewLedger(path=init_config.REVIEW_LEDGER_PATH,
+                                                   ttl=init_config.REVIEW_CACHE_TTL),
+                               debug_mr_setup=bool(init_config.DEBUG_MR_SETUP),
+                               batch_concurrency=init_config.REVIEW_BATCH_CONCURRENCY,
+                               batch_max_items=init_config.REVIEW_BATCH_MAX_ITEMS)
+metrics_state = StateCollector(outbox, snapshot_path=init_config.TEAM_SNAPSHOT_PATH)
+profiler = SamplingProfiler()
+config_started = asyncio.Event()
+
+# Период (сек) проверки снимка конфигурации и запросов на внеочередную загрузку.
+# Gitlab опрашивается ведущим воркером не чаще TEAM_CONFIG_UPDATE_INTERVAL
+CONFIG_SYNC_TICK = 1
+
+
+async def _retry(func, name: str, max_delay: float = 60):
+    """Повторяет блокирующий вызов с экспоненциальной задержкой, пока он не вернет истинное значение."""
+    delay = 1
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if await loop.run_in_executor(None, func):
+                return
+            log.warning(f"{name} недоступен, повторная попытка через {delay} сек")
+        except Exception as ex:
+            log.exception(f"Ошибка инициализации ({name}), повторная попытка через {delay} сек -> [{ex}]")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def start_config() -> bool:
+    config_sync.start()
+    return True
+
+
+async def initialize():
+    """Фоновая инициализация: подключение к Gitlab и Mattermost, актуализация конфигурации."""
+    loop = asyncio.get_running_loop()
+    try:
+        await _retry(git.connect, "Gitlab")
+        readiness.set("gitlab")
+
+        await _retry(start_config, "Конфигурация команд")
+        readiness.set("config", team.loaded)
+    finally:
+        # Периодическое обновление конфигурации запускается в любом случае: оно же повторит неудачную загрузку
+        config_started.set()
+
+    await _retry(bot.connect, "Mattermost")
+    try:
+        await loop.run_in_executor(None, bot.warm_up, team.usernames())
+    except Exception as ex:
+        log.exception(f"Ошибка предварительной загрузки пользователей Mattermost -> [{ex}]")
 
-if init_config:
-    if init_config.SENTRY_DSN:
-        import sentry_sdk
 
-        sentry_sdk.init(
-            dsn=init_config.SENTRY_DSN,
-            traces_sample_rate=init_config.SENTRY_TRACES_SAMPLE_RATE,
-        )
-    bot = Bot(init_config)
-    git = Git(init_config)
-    team = Team(git=git)
+def periodic():
+    if config_sync.tick(init_config.TEAM_CONFIG_UPDATE_INTERVAL):
+        bot.warm_up(team.usernames())
+    readiness.set("config", team.loaded)
 
-    if not team:
-        log.error("Ошибка инициализации базового класса")
-        sys.exit()
 
-from .views import api_router
+async def run_periodic():
+    loop = asyncio.get_running_loop()
+    await config_started.wait()
+    while True:
+        await asyncio.sleep(CONFIG_SYNC_TICK)
+        try:
+            await loop.run_in_executor(None, periodic)
+        except Exception as ex:
+            log.exception(f"Ошибка обновления конфигурации -> [{ex}]")
 
-app = FastAPI()
 
+async def run_load_reconcile():
+    """Периодическая сверка нагрузки ревьюверов с Gitlab. Выполняется только ведущим воркером."""
+    loop = asyncio.get_running_loop()
+    await config_started.wait()
+    while True:
+        if config_sync.is_leader:
+            try:
+                await loop.run_in_executor(None, team.reconcile_load)
+            except Exception as ex:
+                log.exception(f"Ошибка сверки нагрузки ревьюверов -> [{ex}]")
+        await asyncio.sleep(init_config.REVIEW_LOAD_RECONCILE_INTERVAL)
 
-@app.on_event("startup")
-@repeat_every(seconds=init_config.TEAM_CONFIG_UPDATE_INTERVAL, logger=log, wait_first=True)
-def periodic():
-    team.update_config()
 
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if config_sync.load_persisted():
+        readiness.set("config", team.loaded)
+    tasks = [asyncio.create_task(initialize()),
+             asyncio.create_task(run_periodic()),
+             asyncio.create_task(dispatcher.run())]
+    if init_config.REVIEW_LOAD_RECONCILE_INTERVAL:
+        tasks.append(asyncio.create_task(run_load_reconcile()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await dispatcher.stop()
+
+
+class RequestIdMiddleware:
+    """Добавляет request_id (X-Request-ID) во все записи лога, сделанные при обработке запроса, и в ответ.
+
+    ASGI-middleware без BaseHTTPMiddleware: запрос обрабатывается в той же задаче, потоковые ответы не буферизуются.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = request_id(Headers(scope=scope).get("X-Request-ID"))
 
-@app.on_event("startup")
-@repeat_every(seconds=init_config.MM_BOT_MSG_INTERVAL, logger=log, wait_first=True)
-def read_q():
-    log.debug(f"Читаем очередь. Интервал {init_config.MM_BOT_MSG_INTERVAL}")
-    items = [msg_queue.get() for _ in range(msg_queue.qsize())]
-    for queue_mr_result in items:
-        if queue_mr_result:
-            log.debug(queue_mr_result)
-            msg = bot.send_mr_notice_message(queue_mr_result)
-            if queue_mr_result.review_channel:
-                bot.send_group_message(queue_mr_result)
-            if not len(msg):
-                msg_error_queue.put(queue_mr_result)
-                msg_queue.put(queue_mr_result)
-                log.error(f"Ошибка ивента отправки в чат. Item отправлен в очередь с ошибками {queue_mr_result}")
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = rid
+            await send(message)
 
+        with log.contextualize(request_id=rid):
+            await self.app(scope, receive, send_with_request_id)
 
 
+class TraceMiddleware:
+    """Корневой спан OTLP для каждого запроса, кроме служебных. Ответ 5xx отмечает спан как ошибочный."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            return await self.app(scope, receive, send)
+
+        async def send_traced(message: Message):
+            if message["type"] == "http.response.start" and message["status"] >= 500:
+                mark_failed()
+            await send(message)
+
+        with transaction("http.server", f"{scope['method']} {scope['path']}", sentry=False):
+            await self.app(scope, receive, send_traced)
+
+
+from .views import api_router
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(api_router)
+if init_config.TRACES_OTLP_FILE:
+    app.add_middleware(TraceMiddleware)
+app.add_middleware(RequestIdMiddleware)
@@ -1,4 +1,4 @@
-from .app import team, git
+from .app import team, git, review_service
 from .services import TeamService, GitService
 
 
@@ -8,3 +8,7 @@ async def get_team_service():
 
 async def get_git_service():
     return GitService(git=git)
+
+
+async def get_review_service():
+    return review_service
@@ -0,0 +1,55 @@
+import requests
+from loguru import logger as log
+from mattermostdriver.client import Client
+from mattermostdriver.exceptions import InvalidOrMissingParameters, NoAccessTokenProvided, NotEnoughPermissions, \
+    ResourceNotFound, MethodNotAllowed, ContentTooLarge, FeatureDisabled
+
+_ERRORS = {
+    400: InvalidOrMissingParameters,
+    401: NoAccessTokenProvided,
+    403: NotEnoughPermissions,
+    404: ResourceNotFound,
+    405: MethodNotAllowed,
+    413: ContentTooLarge,
+    501: FeatureDisabled,
+}
+
+
+class SessionClient(Client):
+    """Клиент Mattermost, выполняющий запросы через общую сессию (options["session"]) вместо requests.get/post."""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self._session: requests.Session = options["session"]
+
+    def make_request(self, method, endpoint, options=None, params=None, data=None, files=None, basepath=None):
+        if basepath:
+            url = f"{self._scheme}://{self._options['url']}:{self._port}{basepath}"
+        else:
+            url = self.url
+        request_params = {
+            "headers": self.auth_header(),
+            "verify": self._verify,
+            "json": options if options is not None else {},
+            "params": params if params is not None else {},
+            "data": data if data is not None else {},
+            "files": files,
+            "timeout": self.request_timeout,
+        }
+        if self._auth is not None:
+            request_params["auth"] = self._auth()
+
+        response = self._session.request(method.upper(), url + endpoint, **request_params)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            try:
+                message = e.response.json().get("message", e.response.text)
+            except ValueError:
+                message = e.response.text
+            log.error(f"Ошибка запроса к Mattermost [{method.upper()} {endpoint}] -> [{message}]")
+            error = _ERRORS.get(e.response.status_code)
+            if error:
+                raise error(message) from None
+            raise
+        return response
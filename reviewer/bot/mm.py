@@ -1,11 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
 from loguru import logger as log
 from mattermostdriver import Driver
 from mattermostdriver.exceptions import NoAccessTokenProvided, ResourceNotFound, InvalidOrMissingParameters
 from requests.exceptions import ConnectionError
 
 from reviewer.config import InitConfig
+from reviewer.logs import throttled
+from reviewer.sessions import PooledSession
 from reviewer.teams.schemas import MrCrResultData, GitUser
-from reviewer.utilites import render_template
+from reviewer.utilites import render_template, TTLCache, MISSING
+from .client import SessionClient
 from .schemas import Config, MessageCodeReviewNotice, \
     MessageCodeReviewNoticeField, MessageCodeReviewNoticeAttachment
 
@@ -13,20 +19,34 @@ from .schemas import Config, MessageCodeReviewNotice, \
 class Bot:
     _cfg: Config
     _link: Driver
-    _bot_id: str
+    session: PooledSession
+    _bot_id: str | None = None
     _init_cfg: InitConfig
+    _users: TTLCache
+    _channels: TTLCache
 
     def __init__(self, init_cfg: InitConfig):
-        self._cfg = Config(url=init_cfg.MM_HOST, token=init_cfg.MM_TOKEN)
-        self._link = Driver(self._cfg.dict())
+        self._cfg = Config(url=init_cfg.MM_HOST, token=init_cfg.MM_TOKEN, request_timeout=init_cfg.MM_TIMEOUT)
+        self.session = PooledSession(name="mattermost",
+                                     pool_size=init_cfg.HTTP_POOL_SIZE,
+                                     retries=init_cfg.HTTP_RETRIES,
+                                     backoff_factor=init_cfg.HTTP_BACKOFF_FACTOR,
+                                     backoff_max=init_cfg.HTTP_BACKOFF_MAX,
+                                     timeout=init_cfg.MM_TIMEOUT)
+        self._link = Driver({**self._cfg.dict(), "session": self.session}, client_cls=SessionClient)
         self._init_cfg = init_cfg
-        self._connect()
+        self._users = TTLCache(maxsize=init_cfg.MM_CACHE_SIZE, ttl=init_cfg.MM_CACHE_TTL, name="mm_users")
+        self._channels = TTLCache(maxsize=init_cfg.MM_CACHE_SIZE, ttl=init_cfg.MM_CACHE_TTL, name="mm_channels")
+
+    @property
+    def connected(self) -> bool:
+        return self._bot_id is not None
 
-    def _connect(self) -> dict | None:
+    def connect(self) -> dict | None:
         try:
             resp = self._link.login()
             if resp:
-                log.debug(resp)
+                log.debug("Mattermost login -> {}", resp)
                 self._bot_id = resp['id']
                 return resp
         except ConnectionError as ex:
@@ -48,7 +68,10 @@ class Bot:
     def get_user_by_username(self, username: str) -> dict | None:
         try:
             if username:
-                user = self._link.users.get_user_by_username(username)
+                user = self._users.get(username)
+                if user is MISSING:
+                    user = self._link.users.get_user_by_username(username)
+                    self._users.set(username, user)
                 return user
         except ResourceNotFound:
             log.warning(f"Пользователь с username: [{username}] не найден в каналах Mattermost")
@@ -56,15 +79,60 @@ class Bot:
 
     def _create_private_channel(self, user_id: str) -> str | None:
         try:
-            channel = self._link.channels.create_direct_message_channel([self._bot_id, user_id])
-            channel_id = channel["id"]
+            channel_id = self._channels.get(user_id)
+            if channel_id is MISSING:
+                channel = self._link.channels.create_direct_message_channel([self._bot_id, user_id])
+                channel_id = channel["id"]
+                if channel_id:
+                    self._channels.set(user_id, channel_id)
             if channel_id:
                 return channel_id
         except InvalidOrMissingParameters as ex:
             log.error(f"Ошибка создания канала для пользователя -> [{ex}]")
             return None
 
+    def _invalidate(self, username: str, user: dict | None = None):
+        """Сбрасывает кэш пользователя и его личного канала после ResourceNotFound."""
+        self._users.pop(username)
+        if user:
+            self._channels.pop(user["id"])
+
+    def warm_up(self, usernames: Iterable[str]) -> list[str]:
+        """Заранее загружает пользователей и открывает личные каналы. Возвращает username, не найденные в Mattermost."""
+        names = {name.strip() for name in usernames if name and name.strip()}
+        if self._init_cfg.DEBUG_REVIEWER_USERNAME:
+            names.add(self._init_cfg.DEBUG_REVIEWER_USERNAME)
+        if not names or not self.connected:
+            return []
+
+        requested = {name.lower(): name for name in names}
+        found = {}
+        ordered = sorted(requested)
+        try:
+            for start in range(0, len(ordered), 100):
+                for user in self._link.users.get_users_by_usernames(ordered[start:start + 100]) or []:
+                    name = requested.get(user["username"].lower())
+                    if name:
+                        self._users.set(name, user)
+                        found[name] = user
+        except (ConnectionError, InvalidOrMissingParameters) as ex:
+            log.error(f"Ошибка загрузки пользователей Mattermost -> [{ex}]")
+            return []
+
+        with ThreadPoolExecutor(max_workers=self._init_cfg.MM_DISPATCH_CONCURRENCY) as pool:
+            list(pool.map(self._create_private_channel, [user["id"] for user in found.values()]))
+
+        missing = sorted(names - found.keys())
+        if missing:
+            log.warning(f"Пользователи указаны в конфигурации, но не найдены в Mattermost: {missing}")
+        log.info(f"Кэш Mattermost прогрет: пользователей {len(found)}, не найдено {len(missing)}")
+        return missing
+
+    def cache_stats(self) -> dict:
+        return {"users": self._users.stats(), "channels": self._channels.stats()}
+
     def send_private_message(self, username: str, text: str) -> str | None:
+        user = None
         try:
             user = self.get_user_by_username(username)
             if user:
@@ -78,11 +146,12 @@ class Bot:
             else:
                 return None
         except ResourceNotFound:
+            self._invalidate(username, user)
             log.warning(f"Адресат [{username}] не найден в каналах Mattermost")
         except InvalidOrMissingParameters as ex:
             log.error(f"Неверно заданы параметры -> [{ex}]")
 
-    def send_group_message(self, queue_mr_result: MrCrResultData):
+    def send_group_message(self, queue_mr_result: MrCrResultData) -> bool:
         try:
             mr_reviewers_username = [self.get_user_by_username(rev_uname.uname)["username"] for rev_uname in queue_mr_result.mr_reviewers]
             tmpl_variables = {
@@ -98,12 +167,15 @@ class Bot:
 
             msg = render_template('bot-msg-group.j2', tmpl_variables)
             self._link.posts.create_post({"channel_id": queue_mr_result.review_channel, "message": msg})
+            return True
         except Exception as ex:
             log.error(f"Возникла ошибка при отправке сообщения в групповой канал для команды [{queue_mr_result.review_team}] -> [{ex}]")
+            return False
 
     def send_mr_notice_message(self, queue_mr_result: MrCrResultData) -> list[dict] | None:
         msg = []
         for reviewer in queue_mr_result.mr_reviewers:
+            user = None
             try:
                 if self._init_cfg.DEBUG_REVIEWER_USERNAME:
                     user_name = self._init_cfg.DEBUG_REVIEWER_USERNAME
@@ -118,9 +190,10 @@ class Bot:
                         notice.channel_id = channel_id
                         m = self._link.posts.create_post(notice.dict())
                         msg.append(m)
-                        log.info("Отправлено сообщение в чат")
-                        log.debug(f"Отправлено сообщение в чат -> {m}")
+                        throttled.info("Отправлено сообщение в чат")
+                        throttled.debug("Отправлено сообщение в чат -> {}", m)
             except ResourceNotFound:
+                self._invalidate(user_name, user)
                 log.warning(f"Адресат [{reviewer.uname}] не найден в каналах Mattermost")
             except InvalidOrMissingParameters as ex:
                 log.error(f"Неверно заданы параметры -> [{ex}]")
@@ -9,7 +9,7 @@ class Config(BaseModel):
     token: str
     debug: bool = False
     port: int = 443
-    request_timeout: int = 5
+    request_timeout: float = 5
     basepath: str = "/api/v4"
 
 
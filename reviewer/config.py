@@ -15,6 +15,16 @@ class LogLevel(str, Enum):
     DEBUG = "DEBUG"
 
 
+class LogFormat(str, Enum):
+    TEXT = "TEXT"
+    JSON = "JSON"
+
+
+class DiffMode(str, Enum):
+    SIZE = "SIZE"
+    FULL = "FULL"
+
+
 class InitConfig(BaseModel):
     GITLAB_URL: HttpUrl
     GITLAB_TOKEN: str
@@ -22,17 +32,48 @@ class InitConfig(BaseModel):
     MM_HOST: str
     MM_PORT: int = 443
     MM_BOT_MSG_INTERVAL: int = 30
+    MM_DISPATCH_CONCURRENCY: int = 4
+    MM_CACHE_TTL: int = 3600
+    MM_CACHE_SIZE: int = 5000
     TEAM_CONFIG_PROJECT: str
     TEAM_CONFIG_FILE: str = "team-config.yaml"
     TEAM_CONFIG_BRANCH: str = "master"
     LOG_LEVEL: LogLevel = LogLevel.INFO
+    LOG_FORMAT: LogFormat = LogFormat.TEXT
+    LOG_RATE_LIMIT: int = 10
     AUTH_TOKEN: Optional[str]
     SERVER_ADDRESS: str = "0.0.0.0"
     SERVER_PORT: int = 8080
     SERVER_WORKERS: int = 3
     TEAM_CONFIG_UPDATE_INTERVAL: int = 60
+    GITLAB_WEBHOOK_TOKEN: Optional[str]
+    TEAM_SNAPSHOT_PATH: str = "/opt/data/team-snapshot.json"
+    GITLAB_USER_CACHE_TTL: int = 3600
+    GITLAB_USER_CACHE_SIZE: int = 5000
+    GITLAB_USER_FETCH_CONCURRENCY: int = 8
+    GITLAB_IO_WORKERS: int = 16
+    GITLAB_DIFF_MODE: DiffMode = DiffMode.SIZE
+    OUTBOX_PATH: str = "/opt/data/outbox.sqlite3"
+    OUTBOX_MAX_ATTEMPTS: int = 10
+    OUTBOX_BACKOFF_BASE: int = 30
+    OUTBOX_BACKOFF_MAX: int = 3600
+    REVIEW_LEDGER_PATH: str = "/opt/data/reviews.sqlite3"
+    REVIEW_LOAD_PATH: str = "/opt/data/review-load.sqlite3"
+    REVIEW_CACHE_TTL: int = 86400
+    REVIEW_BATCH_CONCURRENCY: int = 4
+    REVIEW_BATCH_MAX_ITEMS: int = 500
+    REVIEW_LOAD_RECONCILE_INTERVAL: int = 3600
+    REVIEW_OWNERS_MAX_REVIEWERS: int = 2
+    HTTP_POOL_SIZE: int = 20
+    HTTP_RETRIES: int = 3
+    HTTP_BACKOFF_FACTOR: float = 0.5
+    HTTP_BACKOFF_MAX: float = 30
+    GITLAB_TIMEOUT: float = 10
+    MM_TIMEOUT: float = 5
     SENTRY_DSN: Optional[HttpUrl]
-    SENTRY_TRACES_SAMPLE_RATE: float = 1.0
+    SENTRY_TRACES_SAMPLE_RATE: float = 0.1
+    TRACES_SLOW_THRESHOLD: float = 1.0
+    TRACES_OTLP_FILE: Optional[str]
     DEBUG_REVIEWER_ID: Optional[int]
     DEBUG_REVIEWER_EMAIL: Optional[EmailStr]
     DEBUG_REVIEWER_USERNAME: Optional[str]
@@ -42,7 +83,7 @@ class InitConfig(BaseModel):
     def to_uppercase(cls, values: dict):
         upper_val = {}
         for k, v in values.items():
-            if str(k).upper() == "LOG_LEVEL":
+            if str(k).upper() in ("LOG_LEVEL", "LOG_FORMAT", "GITLAB_DIFF_MODE"):
                 v = str(v).upper()
             upper_val[str(k).upper()] = v
         return upper_val
@@ -0,0 +1,135 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger as log
+
+from .bot import Bot
+from .outbox import Outbox
+from .schemas import OutboxItem
+from .tracing import transaction, span, mark_failed
+
+
+class Dispatcher:
+    """Отправляет уведомления из outbox параллельно, сохраняя порядок для каждого адресата (личного или группового канала).
+
+    Из outbox забирается не больше элементов, чем свободных мест для отправки: элемент не ждет своей очереди дольше
+    аренды (lease) и не выдается повторно этому или другому воркеру.
+    """
+
+    def __init__(self, outbox: Outbox, bot: Bot, concurrency: int, poll_interval: float, batch_size: int = 100):
+        self._outbox = outbox
+        self._bot = bot
+        self._poll_interval = poll_interval
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency + 1, thread_name_prefix="mm-dispatch")
+        self._wakeup = asyncio.Event()
+        # Последнее поставленное в работу уведомление каждого адресата: следующее ждет его завершения
+        self._recipient_tails: dict[str, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def notify(self):
+        """Будит диспетчер сразу после добавления элемента в outbox."""
+        self._wakeup.set()
+
+    async def _run_io(self, func, *args):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def run(self):
+        log.info("Диспетчер уведомлений запущен")
+        while True:
+            self._wakeup.clear()
+            limit = min(self._batch_size, self._concurrency - len(self._tasks))
+            items = []
+            if limit > 0:
+                try:
+                    items = await self._run_io(self._outbox.claim, limit)
+                except Exception as ex:
+                    log.exception(f"Ошибка чтения очереди уведомлений -> [{ex}]")
+
+            for item in items:
+                task = asyncio.create_task(self._dispatch(item, *self._enqueue(item)))
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+
+            if items and len(items) == limit and len(self._tasks) < self._concurrency:
+                continue
+
+            timeout = self._poll_interval
+            next_attempt_in = await self._run_io(self._outbox.next_attempt_in)
+            if next_attempt_in is not None:
+                timeout = min(timeout, max(next_attempt_in, 0.05))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._wakeup.set()
+
+    async def stop(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _recipients(item: OutboxItem) -> list[str]:
+        recipients = [f"@{reviewer.uname}" for reviewer in item.payload.mr_reviewers]
+        if item.payload.review_channel:
+            recipients.append(f"~{item.payload.review_channel}")
+        return recipients
+
+    def _enqueue(self, item: OutboxItem) -> tuple[list[asyncio.Future], asyncio.Future]:
+        """Ставит уведомление в очередь каждого его адресата. Возвращает незавершенные уведомления тех же адресатов,
+        поставленные раньше, и признак завершения этого уведомления."""
+        done = asyncio.get_running_loop().create_future()
+        previous = []
+        for recipient in self._recipients(item):
+            tail = self._recipient_tails.get(recipient)
+            if tail is not None and tail not in previous:
+                previous.append(tail)
+            self._recipient_tails[recipient] = done
+        return previous, done
+
+    async def _dispatch(self, item: OutboxItem, previous: list[asyncio.Future], done: asyncio.Future):
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            try:
+                await self._run_io(self._deliver, item)
+            except Exception as ex:
+                log.exception(f"Ошибка отправки уведомления [{item.payload.project_name}] -> [{ex}]")
+                await self._run_io(self._outbox.fail, item, str(ex))
+        finally:
+            done.set_result(None)
+            for recipient in self._recipients(item):
+                if self._recipient_tails.get(recipient) is done:
+                    del self._recipient_tails[recipient]
+
+    def _deliver(self, item: OutboxItem):
+        with transaction("notify.dispatch", "dispatch review notification", attempt=item.attempts):
+            self._deliver_traced(item)
+
+    def _deliver_traced(self, item: OutboxItem):
+        if not self._bot.connected and not self._bot.connect():
+            raise ConnectionError("Нет подключения к Mattermost")
+        queue_mr_result = item.payload
+        log.debug("Уведомление -> {}", queue_mr_result)
+        if not item.reviewers_sent:
+            with span("notify.reviewers", "send reviewer messages"):
+                item.reviewers_sent = bool(self._bot.send_mr_notice_message(queue_mr_result))
+        if queue_mr_result.review_channel and not item.group_sent:
+            with span("notify.group", "send group message"):
+                item.group_sent = self._bot.send_group_message(queue_mr_result)
+        if item.reviewers_sent and (item.group_sent or not queue_mr_result.review_channel):
+            self._outbox.ack(item.id)
+            return
+        error = "Не отправлено ни одного личного сообщения" if not item.reviewers_sent \
+            else "Не отправлено сообщение в групповой канал"
+        self._outbox.fail(item, error)
+        mark_failed()
+        log.error(f"Ошибка ивента отправки в чат для MR [{queue_mr_result.project_name}] -> [{error}]")
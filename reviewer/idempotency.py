@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from .schemas import ReviewOutcome
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    project_id INTEGER NOT NULL,
+    mr_id INTEGER NOT NULL,
+    status INTEGER,
+    detail TEXT,
+    answer TEXT,
+    lease_until REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (project_id, mr_id)
+);
+CREATE INDEX IF NOT EXISTS reviews_expires_at ON reviews (expires_at);
+"""
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один: остальные получают его результат."""
+
+    def __init__(self):
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+
+class ReviewLedger:
+    """Журнал обработки MR на базе SQLite (WAL), общий для всех воркеров пода.
+
+    Первый запрос по MR берет его в аренду (lease), повторные получают сохраненный результат или ждут его.
+    Успешный результат хранится ttl секунд, пропуск MR (4xx/204) - skip_ttl секунд, ошибки (5xx) не сохраняются.
+    Запросы, принятые разными подами, журнал не объединяет: от повторного назначения защищает только проверка
+    ревьюверов MR в Gitlab перед сохранением (ReviewService.setup_review).
+    """
+
+    def __init__(self, path: str, ttl: float, skip_ttl: float = 10, lease: float = 120):
+        self._path = path
+        self._ttl = ttl
+        self._skip_ttl = skip_ttl
+        self._lease = lease
+        self._local = threading.local()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, project_id: int, mr_id: int) -> tuple[bool, ReviewOutcome | None]:
+        """Возвращает (True, None), если MR взят в обработку, (False, результат) или (False, None), если MR уже обрабатывается."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, detail, answer, lease_until, expires_at FROM reviews "
+                               "WHERE project_id = ? AND mr_id = ?", (project_id, mr_id)).fetchone()
+            if row and row[4] is not None and row[4] > now:
+                conn.execute("COMMIT")
+                return False, ReviewOutcome(status=row[0], detail=row[1], answer=row[2])
+            if row and row[4] is None and row[3] > now:
+                conn.execute("COMMIT")
+                return False, None
+            conn.execute("INSERT OR REPLACE INTO reviews (project_id, mr_id, lease_until) VALUES (?, ?, ?)",
+                         (project_id, mr_id, now + self._lease))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True, None
+
+    def complete(self, project_id: int, mr_id: int, outcome: ReviewOutcome):
+        if outcome.status >= 500:
+            self.release(project_id, mr_id)
+            return
+        now = time.time()
+        expires_at = now + (self._ttl if outcome.answer is not None else self._skip_ttl)
+        conn = self._conn()
+        conn.execute("UPDATE reviews SET status = ?, detail = ?, answer = ?, expires_at = ? "
+                     "WHERE project_id = ? AND mr_id = ?",
+                     (outcome.status, outcome.detail, outcome.answer, expires_at, project_id, mr_id))
+        conn.execute("DELETE FROM reviews WHERE expires_at < ?", (now,))
+
+    def release(self, project_id: int, mr_id: int):
+        """Снимает аренду без сохранения результата: следующий запрос обработает MR заново."""
+        self._conn().execute("DELETE FROM reviews WHERE project_id = ? AND mr_id = ? AND expires_at IS NULL",
+                             (project_id, mr_id))
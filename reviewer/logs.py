@@ -0,0 +1,82 @@
+import sys
+import threading
+import time
+import uuid
+
+from loguru import logger as log
+
+from .config import LogFormat
+
+TEXT_FORMAT = ("<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+               "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
+               "<magenta>{extra[request_id]}</magenta> - <level>{message}</level>")
+
+# Логгер для сообщений, которые пишутся на каждый запрос или уведомление: ограничивается RateLimitFilter
+throttled = log.bind(throttle=True)
+
+
+class RateLimitFilter:
+    """Фильтр loguru: сообщения throttled пропускаются не чаще limit раз в секунду для каждого места вызова.
+
+    Количество отброшенных сообщений добавляется к следующему пропущенному, а если место вызова больше не пишет -
+    выводится отдельной записью по окончании окна. limit=0 отключает ограничение.
+    """
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._lock = threading.Lock()
+        # (name, line) -> [начало окна, пропущено в окне, отброшено, последнее отброшенное сообщение]
+        self._windows: dict[tuple, list] = {}
+
+    def __call__(self, record) -> bool:
+        if not self._limit or not record["extra"].get("throttle"):
+            return True
+        key = (record["name"], record["line"])
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0, None]
+            elif window[1] < self._limit:
+                window[1] += 1
+                suppressed, window[2] = window[2], 0
+            else:
+                window[2] += 1
+                window[3] = record["message"]
+                if window[2] == 1:
+                    self._schedule_flush(key, window, record, window[0] + 1 - now)
+                return False
+        if suppressed:
+            record["message"] += f" (пропущено похожих сообщений: {suppressed})"
+        return True
+
+    def _schedule_flush(self, key: tuple, window: list, record, delay: float):
+        site = {"name": record["name"], "function": record["function"], "line": record["line"]}
+        timer = threading.Timer(delay, self._flush, (key, window, site, record["level"].name))
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, key: tuple, window: list, site: dict, level: str):
+        """По окончании окна выводит количество отброшенных сообщений, если место вызова с тех пор не писало."""
+        with self._lock:
+            if self._windows.get(key) is not window or not window[2]:
+                return
+            suppressed, message, window[2] = window[2], window[3], 0
+        log.patch(lambda r: r.update(site)).log(level, "Пропущено похожих сообщений: {}, последнее: {}",
+                                                suppressed, message)
+
+
+def setup_logging(level, log_format: LogFormat, rate_limit: int, sink=sys.stderr):
+    """Настраивает вывод логов: текст или JSON (одна запись на строку) с request_id запроса."""
+    log.remove()
+    log.configure(extra={"request_id": "-"})
+    if log_format == LogFormat.JSON:
+        log.add(sink, level=level, serialize=True, filter=RateLimitFilter(rate_limit))
+    else:
+        log.add(sink, level=level, format=TEXT_FORMAT, filter=RateLimitFilter(rate_limit))
+
+
+def request_id(header: str | None) -> str:
+    """Идентификатор запроса: переданный клиентом (X-Request-ID) или новый."""
+    return header[:64] if header else uuid.uuid4().hex
@@ -4,9 +4,11 @@ import uvicorn
 from loguru import logger as log
 
 from reviewer.app import init_config
+from reviewer.metrics import reset_multiprocess_dir
 
 if __name__ == '__main__':
     try:
+        reset_multiprocess_dir()
         uvicorn.run("reviewer.app:app",
                     host=init_config.SERVER_ADDRESS,
                     port=init_config.SERVER_PORT,
@@ -0,0 +1,73 @@
+import glob
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from .profiling import record_timing
+from .tracing import span
+
+# В режиме нескольких воркеров uvicorn значения метрик пишутся в общий каталог (стандартная переменная prometheus_client)
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+STAGE_SECONDS = Histogram("review_stage_seconds", "Длительность этапов настройки код-ревью", ["stage"],
+                          buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+HTTP_CLIENT_SECONDS = Histogram("http_client_request_seconds", "Длительность запросов к внешним API (с повторами)",
+                                ["service", "method", "status"],
+                                buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+REVIEW_OUTCOMES = Counter("review_outcomes_total", "Результаты обработки запросов на код-ревью", ["status", "reason"])
+CONFIG_RELOAD_SECONDS = Histogram("config_reload_seconds", "Длительность загрузки конфигурации команд из Gitlab",
+                                  ["changed"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Обращения к кэшам", ["cache", "result"])
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет длительность этапа обработки в review_stage_seconds и Server-Timing запроса, оборачивает его в спан."""
+    started = time.perf_counter()
+    try:
+        with span("review.stage", name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        record_timing(name, elapsed)
+
+
+def reset_multiprocess_dir():
+    """Удаляет значения метрик предыдущего запуска. Вызывается до старта воркеров."""
+    if MULTIPROC_DIR:
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+class StateCollector:
+    """Метрики состояния, вычисляемые в момент запроса /metrics: очередь уведомлений и возраст снимка конфигурации."""
+
+    def __init__(self, outbox, snapshot_path: str):
+        self._outbox = outbox
+        self._snapshot_path = snapshot_path
+
+    def collect(self):
+        yield GaugeMetricFamily("outbox_depth", "Уведомлений в очереди отправки", value=self._outbox.depth())
+        yield GaugeMetricFamily("outbox_dead_letters", "Уведомлений в dead letters", value=self._outbox.dead_count())
+        try:
+            age = time.time() - os.stat(self._snapshot_path).st_mtime
+        except FileNotFoundError:
+            age = float("nan")
+        yield GaugeMetricFamily("config_snapshot_age_seconds", "Возраст снимка конфигурации команд", value=age)
+
+
+def render(state: StateCollector) -> bytes:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    state_registry = CollectorRegistry(auto_describe=False)
+    state_registry.register(state)
+    return generate_latest(registry) + generate_latest(state_registry)
@@ -0,0 +1,171 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from loguru import logger as log
+
+from .schemas import OutboxItem, DeadLetter
+from .teams.schemas import MrCrResultData
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    reviewers_sent INTEGER NOT NULL DEFAULT 0,
+    group_sent INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_next_attempt_at ON outbox (next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    reviewers_sent INTEGER NOT NULL DEFAULT 0,
+    group_sent INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Колонки, добавленные после создания схемы: в существующие базы добавляются при запуске
+_COLUMNS = {"reviewers_sent": "INTEGER NOT NULL DEFAULT 0", "group_sent": "INTEGER NOT NULL DEFAULT 0"}
+_MIGRATED_TABLES = ("outbox", "dead_letters")
+
+
+class Outbox:
+    """Персистентная очередь уведомлений Mattermost на базе SQLite (WAL), общая для всех воркеров."""
+
+    def __init__(self, path: str, max_attempts: int, backoff_base: float, backoff_max: float, lease: float = 120):
+        self._path = path
+        self._max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._lease = lease
+        self._local = threading.local()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        conn = self._conn()
+        for table in _MIGRATED_TABLES:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in _COLUMNS.items():
+                if column not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    except sqlite3.OperationalError:
+                        # Колонку одновременно добавил другой воркер
+                        pass
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, item: MrCrResultData) -> int:
+        now = time.time()
+        cur = self._conn().execute("INSERT INTO outbox (payload, next_attempt_at, created_at) VALUES (?, ?, ?)",
+                                   (item.json(), now, now))
+        return cur.lastrowid
+
+    def claim(self, limit: int = 100) -> list[OutboxItem]:
+        """Забирает готовые к отправке элементы, откладывая их повторную выдачу на время аренды (lease)."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT id, payload, attempts, reviewers_sent, group_sent FROM outbox "
+                                "WHERE next_attempt_at <= ? "
+                                "ORDER BY next_attempt_at LIMIT ?", (now, limit)).fetchall()
+            conn.executemany("UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                             [(now + self._lease, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [OutboxItem(id=row[0], attempts=row[2], reviewers_sent=row[3], group_sent=row[4],
+                           payload=MrCrResultData.parse_raw(row[1])) for row in rows]
+
+    def ack(self, item_id: int):
+        self._conn().execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+
+    def fail(self, item: OutboxItem, error: str) -> bool:
+        """Планирует повторную отправку с экспоненциальной задержкой. Возвращает True, если элемент перенесен в dead letters.
+
+        Сохраняет, каким адресатам уведомление уже отправлено (reviewers_sent, group_sent): при повторе, в том числе
+        после replay из dead letters, они пропускаются.
+        """
+        attempts = item.attempts + 1
+        conn = self._conn()
+        if attempts >= self._max_attempts:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT INTO dead_letters (payload, attempts, last_error, created_at, failed_at, "
+                             "reviewers_sent, group_sent) SELECT payload, ?, ?, created_at, ?, ?, ? FROM outbox WHERE id = ?",
+                             (attempts, error, time.time(), item.reviewers_sent, item.group_sent, item.id))
+                conn.execute("DELETE FROM outbox WHERE id = ?", (item.id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            log.error(f"Уведомление [{item.payload.project_name}] перенесено в dead letters после {attempts} попыток")
+            return True
+
+        delay = min(self._backoff_base * 2 ** item.attempts, self._backoff_max) * random.uniform(0.5, 1.0)
+        conn.execute("UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ?, reviewers_sent = ?, "
+                     "group_sent = ? WHERE id = ?",
+                     (attempts, error, time.time() + delay, item.reviewers_sent, item.group_sent, item.id))
+        log.warning(f"Повторная отправка уведомления [{item.payload.project_name}] через {delay:.0f} сек "
+                    f"(попытка {attempts} из {self._max_attempts})")
+        return False
+
+    def next_attempt_in(self) -> float | None:
+        """Время (сек) до ближайшей запланированной отправки или None, если очередь пуста."""
+        row = self._conn().execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+        return row[0] - time.time() if row[0] is not None else None
+
+    def depth(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def dead_letters(self, limit: int = 100) -> list[DeadLetter]:
+        rows = self._conn().execute("SELECT id, payload, attempts, last_error, created_at, failed_at, reviewers_sent, "
+                                    "group_sent FROM dead_letters ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [DeadLetter(id=row[0], payload=MrCrResultData.parse_raw(row[1]), attempts=row[2], last_error=row[3],
+                           created_at=row[4], failed_at=row[5], reviewers_sent=row[6], group_sent=row[7])
+                for row in rows]
+
+    def replay(self, dead_id: int) -> int | None:
+        """Возвращает элемент из dead letters в очередь отправки. Уже доставленная часть уведомления не отправляется."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT payload, created_at, reviewers_sent, group_sent FROM dead_letters WHERE id = ?",
+                               (dead_id,)).fetchone()
+            if not row:
+                conn.execute("ROLLBACK")
+                return None
+            cur = conn.execute("INSERT INTO outbox (payload, next_attempt_at, created_at, reviewers_sent, group_sent) "
+                               "VALUES (?, ?, ?, ?, ?)", (row[0], now, row[1], row[2], row[3]))
+            conn.execute("DELETE FROM dead_letters WHERE id = ?", (dead_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.lastrowid
@@ -0,0 +1,129 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+_STDLIB_DIR = os.path.dirname(threading.__file__)
+# Функции стандартной библиотеки, в которых потоки простаивают: такие стеки по умолчанию не учитываются
+_IDLE_FUNCTIONS = frozenset({"wait", "select", "poll", "accept", "get", "_worker", "_wait_for_tstate_lock"})
+
+_timings: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar("server_timings", default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    if "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    elif path.startswith(_STDLIB_DIR):
+        path = os.path.relpath(path, _STDLIB_DIR)
+    else:
+        path = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    return frame.f_code.co_name in _IDLE_FUNCTIONS and frame.f_code.co_filename.startswith(_STDLIB_DIR)
+
+
+def _fold(frame, thread_name: str, idle: bool) -> str | None:
+    """Стек потока в формате folded: "поток;внешний вызов;...;текущая функция"."""
+    if not idle and _is_idle(frame):
+        return None
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append(thread_name.rstrip("0123456789_"))
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Семплирующий профайлер воркера: с интервалом interval снимает стеки всех потоков (sys._current_frames).
+
+    Работает seconds секунд или до завершения requests запросов /review. Результат - folded stacks,
+    совместимые с flamegraph.pl и speedscope. На время сессии можно включить заголовок Server-Timing в ответах /review.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stacks: Counter = Counter()
+        self._requests_left: int | None = None
+        self.server_timing = False
+        self.session: dict | None = None
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, requests: int = 0, interval: float = 0.01, server_timing: bool = False,
+              idle: bool = False) -> bool:
+        """Запускает сессию профилирования. Возвращает False, если сессия уже идет."""
+        with self._lock:
+            if self.active:
+                return False
+            self._stacks = Counter()
+            self._stop.clear()
+            self._requests_left = requests or None
+            self.server_timing = server_timing
+            self.session = {"pid": os.getpid(), "started_at": time.time(), "seconds": seconds, "requests": requests,
+                            "interval": interval, "samples": 0}
+            self._thread = threading.Thread(target=self._run, args=(seconds, interval, idle), name="profiler",
+                                            daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def request_done(self):
+        """Учитывает завершенный запрос. Сессия, ограниченная количеством запросов, останавливается на последнем."""
+        with self._lock:
+            if self._requests_left is None:
+                return
+            self._requests_left -= 1
+            if self._requests_left <= 0:
+                self._stop.set()
+
+    def _run(self, seconds: float, interval: float, idle: bool):
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [_fold(frame, names.get(ident, str(ident)), idle)
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._lock:
+                self._stacks.update(stack for stack in stacks if stack)
+            samples += 1
+        with self._lock:
+            self._requests_left = None
+            self.server_timing = False
+            self.session.update(samples=samples, finished_at=time.time())
+
+    def folded(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def track_timings() -> dict[str, float]:
+    """Начинает сбор длительностей этапов текущего запроса для заголовка Server-Timing."""
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def record_timing(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def server_timing_header(timings: dict[str, float], total: float) -> str:
+    metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
@@ -0,0 +1,25 @@
+import time
+
+from loguru import logger as log
+
+
+class Readiness:
+    """Готовность воркера к обработке запросов: набор проверок, выставляемых фоновой инициализацией."""
+
+    def __init__(self, *checks: str):
+        self._started_at = time.monotonic()
+        self._checks = {name: False for name in checks}
+        self.ready_after: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self._checks.values())
+
+    def set(self, name: str, value: bool = True):
+        self._checks[name] = value
+        if self.ready and self.ready_after is None:
+            self.ready_after = round(time.monotonic() - self._started_at, 3)
+            log.info(f"Сервис готов к обработке запросов через {self.ready_after} сек после запуска")
+
+    def state(self) -> dict:
+        return {"ready": self.ready, "checks": dict(self._checks), "ready_after": self.ready_after}
@@ -3,7 +3,7 @@ from typing import Optional
 
 from pydantic import BaseModel, HttpUrl
 
-from reviewer.teams.schemas import GitUser
+from reviewer.teams.schemas import GitUser, MrCrResultData
 
 
 class MrSetupAnswer(BaseModel):
@@ -20,3 +20,55 @@ class MrSetupAnswer(BaseModel):
     review_lead: Optional[GitUser]
     mr_url: HttpUrl
     timestamp: datetime.datetime = datetime.datetime.now()
+
+
+class OutboxItem(BaseModel):
+    id: int
+    attempts: int
+    reviewers_sent: bool = False
+    group_sent: bool = False
+    payload: MrCrResultData
+
+
+class DeadLetter(BaseModel):
+    id: int
+    attempts: int
+    last_error: Optional[str]
+    created_at: datetime.datetime
+    failed_at: datetime.datetime
+    reviewers_sent: bool = False
+    group_sent: bool = False
+    payload: MrCrResultData
+
+
+class ReviewOutcome(BaseModel):
+    status: int
+    detail: Optional[str]
+    answer: Optional[str]
+
+
+class MrRef(BaseModel):
+    project_id: int
+    mr_id: int
+
+
+class ReviewBatchRequest(BaseModel):
+    items: list[MrRef] = []
+    # Backfill: открытые MR без ревьюверов в проекте или группе (ID или полный путь)
+    project: Optional[str]
+    group: Optional[str]
+
+
+class ReviewBatchResult(BaseModel):
+    project_id: int
+    mr_id: int
+    status: int
+    detail: Optional[str]
+    answer: Optional[MrSetupAnswer]
+    elapsed_ms: float = 0
+
+
+class ReviewBatchSummary(BaseModel):
+    total: int
+    statuses: dict[int, int]
+    elapsed_ms: float
@@ -1,7 +1,29 @@
+import asyncio
+import time
+from collections import Counter
+from typing import AsyncIterator
+
+from fastapi import HTTPException
 from gitlab.v4.objects import ProjectMergeRequest, Project
+from loguru import logger as log
+from pydantic import ValidationError
 
+from .dispatcher import Dispatcher
+from .logs import throttled
+from .idempotency import ReviewLedger, SingleFlight
+from .metrics import REVIEW_OUTCOMES, stage
+from .outbox import Outbox
+from .schemas import MrSetupAnswer, ReviewOutcome, MrRef, ReviewBatchRequest, ReviewBatchResult, ReviewBatchSummary
 from .teams import Team, Git
-from .teams.schemas import GitUser, MrDiffList, Group, Override
+from .teams.schemas import GitUser, MrDiffList, MrCrResultData, Group, Override
+
+
+class ReviewSkipped(HTTPException):
+    """MR пропущен без назначения ревьюверов (204). reason - причина пропуска для метрик."""
+
+    def __init__(self, reason: str):
+        super().__init__(status_code=204, detail="Pass")
+        self.reason = reason
 
 
 class TeamService:
@@ -11,32 +33,306 @@ class TeamService:
     def get_team(self, name: str):
         return self.team.get_team(name)
 
-    def get_random_reviewer_for_user(self, username: str, project: str) -> tuple[list[GitUser], Override] | tuple[list[GitUser], None] | tuple[None, None]:
-        return self.team.get_random_reviewer_for_user(username, project)
+    def get_random_reviewer_for_user(self, username: str, project: str, paths: list[str] | None = None) -> tuple[list[GitUser], Override] | tuple[list[GitUser], None] | tuple[None, None]:
+        return self.team.get_random_reviewer_for_user(username, project, paths)
 
-    def get_user_by_username(self, name: str) -> dict:
+    def get_user_by_username(self, name: str) -> dict | None:
         return self.team.get_user_by_username(name)
 
+    def get_review_team(self, name: str | None, reviewers: list[GitUser], override: Override | None) -> Group:
+        return self.team.get_review_team(name, reviewers, override)
+
+    def covers(self, username: str, project: str) -> bool:
+        return self.team.covers(username, project)
+
+    def record_assignment(self, project_id: int, mr_id: int, reviewers: list[GitUser]):
+        self.team.record_assignment(project_id, mr_id, reviewers)
+
+    def release_reviews(self, project_id: int, mr_id: int) -> int:
+        return self.team.release_reviews(project_id, mr_id)
+
 
 class GitService:
     def __init__(self, git):
         self.git: Git = git
 
-    def get_mr(self, project_id: int, mr_id: int):
-        return self.git.get_mr_info(project_id, mr_id)
+    async def get_mr(self, project_id: int, mr_id: int, project_attrs: dict | None = None):
+        return await self.git.run_io(self.git.get_mr_info, project_id, mr_id, project_attrs)
+
+    async def get_project_attrs(self, project_id: int):
+        return await self.git.run_io(self.git.get_project_attrs, project_id)
+
+    async def list_unreviewed_mrs(self, project: str | None = None, group: str | None = None,
+                                  limit: int | None = None):
+        return await self.git.run_io(self.git.list_unreviewed_mrs, project, group, limit)
+
+    async def has_reviewers(self, mr: ProjectMergeRequest) -> bool:
+        return await self.git.run_io(self.git.has_reviewers, mr)
 
-    def get_commit_info(self, mr):
-        return self.git.get_commits_info(mr)
+    async def get_commit_info(self, mr):
+        return await self.git.run_io(self.git.get_commits_info, mr)
 
     def check_project_exceptions(self, project):
         return self.git.check_project_exceptions(project)
 
-    def set_mr_review_setting(self,
-                              reviewers: list[GitUser],
-                              author: GitUser,
-                              team: Group,
-                              override: Override,
-                              mr: ProjectMergeRequest,
-                              project: Project,
-                              diffs: MrDiffList):
-        return self.git.set_mr_review_setting(reviewers, author, team, override, mr, project, diffs)
+    async def set_mr_review_setting(self,
+                                    reviewers: list[GitUser],
+                                    author: GitUser,
+                                    team: Group,
+                                    override: Override,
+                                    mr: ProjectMergeRequest,
+                                    project: Project,
+                                    diffs: MrDiffList):
+        return await self.git.run_io(self.git.set_mr_review_setting,
+                                     reviewers, author, team, override, mr, project, diffs)
+
+
+class ReviewService:
+    """Настройка код-ревью MR. Повторные и одновременные запросы по одному MR обрабатываются один раз."""
+
+    LEDGER_POLL_INTERVAL = 0.2
+    MR_EVENT_ACTIONS = ("open", "reopen")
+    MR_DONE_ACTIONS = ("close", "merge")
+
+    def __init__(self, team_service: TeamService, git_service: GitService, outbox: Outbox, dispatcher: Dispatcher,
+                 ledger: ReviewLedger, debug_mr_setup: bool = False, batch_concurrency: int = 4,
+                 batch_max_items: int = 500):
+        self.team_service = team_service
+        self.git_service = git_service
+        self.outbox = outbox
+        self.dispatcher = dispatcher
+        self.ledger = ledger
+        self.debug_mr_setup = debug_mr_setup
+        self.batch_concurrency = batch_concurrency
+        self.batch_max_items = batch_max_items
+        self._in_flight = SingleFlight()
+
+    async def _run_io(self, func, *args):
+        """Блокирующие обращения к SQLite выполняются в пуле потоков Gitlab: ожидание блокировки базы, занятой
+        другим воркером, не останавливает event loop."""
+        return await self.git_service.git.run_io(func, *args)
+
+    async def review(self, project_id: int, mr_id: int, project_attrs: dict | None = None) -> MrSetupAnswer:
+        return await self._in_flight.do((project_id, mr_id),
+                                        lambda: self._review_once(project_id, mr_id, project_attrs))
+
+    async def collect_batch(self, request: ReviewBatchRequest) -> list[MrRef]:
+        """Список MR пакета без повторов: явно переданные и найденные в проекте или группе (backfill).
+        Пакет больше batch_max_items MR отклоняется целиком (413)."""
+        items = {(item.project_id, item.mr_id): item for item in request.items}
+        if len(items) <= self.batch_max_items and (request.project or request.group):
+            # Одного MR сверх лимита достаточно, чтобы отклонить пакет: остальные страницы не загружаются
+            found = await self.git_service.list_unreviewed_mrs(request.project, request.group,
+                                                               self.batch_max_items + 1)
+            if found is None:
+                detail = f"Проект {request.project} не найден" if request.project else f"Группа {request.group} не найдена"
+                raise HTTPException(status_code=404, detail=detail)
+            for project_id, mr_id in found:
+                items.setdefault((project_id, mr_id), MrRef(project_id=project_id, mr_id=mr_id))
+        if len(items) > self.batch_max_items:
+            raise HTTPException(status_code=413,
+                                detail=f"В пакете больше {self.batch_max_items} MR, разделите запрос на части")
+        return list(items.values())
+
+    async def review_batch(self, items: list[MrRef]) -> AsyncIterator[str]:
+        """Обрабатывает MR параллельно (не более batch_concurrency одновременно) и отдает результаты в формате NDJSON
+        по мере готовности. Проект загружается один раз для всех его MR."""
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        projects: dict[int, asyncio.Task] = {}
+
+        async def review_item(item: MrRef) -> ReviewBatchResult:
+            async with semaphore:
+                item_started = time.monotonic()
+                result = ReviewBatchResult(project_id=item.project_id, mr_id=item.mr_id, status=200)
+                try:
+                    if item.project_id not in projects:
+                        projects[item.project_id] = asyncio.create_task(
+                            self.git_service.get_project_attrs(item.project_id))
+                    project_attrs = await projects[item.project_id]
+                    result.answer = await self.review(item.project_id, item.mr_id, project_attrs)
+                except HTTPException as ex:
+                    result.status, result.detail = ex.status_code, ex.detail
+                except Exception as ex:
+                    log.exception(f"Ошибка настройки код-ревью для MR {item.mr_id}, project {item.project_id} -> [{ex}]")
+                    result.status, result.detail = 500, str(ex)
+                result.elapsed_ms = round((time.monotonic() - item_started) * 1000, 1)
+                return result
+
+        log.info(f"Пакетная настройка код-ревью для {len(items)} MR")
+        tasks = [asyncio.create_task(review_item(item)) for item in items]
+        statuses = Counter()
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                statuses[result.status] += 1
+                yield result.json(exclude_none=True) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        summary = ReviewBatchSummary(total=len(items), statuses=statuses,
+                                     elapsed_ms=round((time.monotonic() - started) * 1000, 1))
+        log.info(f"Пакетная настройка код-ревью завершена: {summary}")
+        yield summary.json() + "\n"
+
+    @staticmethod
+    def mr_event_ref(event: dict) -> MrRef | None:
+        """MR из события вебхука. None - в событии нет target_project_id или iid."""
+        attrs = event.get("object_attributes")
+        if not isinstance(attrs, dict):
+            return None
+        try:
+            return MrRef(project_id=attrs.get("target_project_id"), mr_id=attrs.get("iid"))
+        except ValidationError:
+            return None
+
+    def check_mr_event(self, event: dict) -> str | None:
+        """Проверяет событие MR по данным из него самого, без обращений к Gitlab. Возвращает причину пропуска."""
+        attrs = event.get("object_attributes") or {}
+        if attrs.get("action") not in self.MR_EVENT_ACTIONS:
+            return f"action {attrs.get('action')}"
+        if attrs.get("state") != "opened":
+            return f"state {attrs.get('state')}"
+        if event.get("reviewers"):
+            return "ревьюверы уже назначены"
+        if any(label.get("title") == "NoCodeReview" for label in event.get("labels") or []):
+            return "установлен флаг 'NoCodeReview'"
+        project = (event.get("project") or {}).get("path_with_namespace") or ""
+        if self.git_service.check_project_exceptions(project):
+            return "проект исключен из code-review"
+        user = event.get("user") or {}
+        if user.get("id") == attrs.get("author_id") and not self.team_service.covers(user.get("username") or "", project):
+            return f"автор [{user.get('username')}] не найден в конфигурации"
+        return None
+
+    async def release_reviews(self, event: dict, mr: MrRef) -> bool:
+        """Снимает нагрузку с ревьюверов закрытого или слитого MR. Возвращает False, если событие не о закрытии MR."""
+        attrs = event.get("object_attributes") or {}
+        if attrs.get("action") not in self.MR_DONE_ACTIONS:
+            return False
+        released = await self._run_io(self.team_service.release_reviews, mr.project_id, mr.mr_id)
+        log.debug("MR {}, project {} закрыт, освобождено ревьюверов: {}", mr.mr_id, mr.project_id, released)
+        return True
+
+    async def review_in_background(self, project_id: int, mr_id: int, project_attrs: dict | None = None):
+        try:
+            await self.review(project_id, mr_id, project_attrs)
+        except HTTPException as ex:
+            throttled.info("Событие MR {}, project {} обработано без назначения ревьюверов -> [{}]",
+                           mr_id, project_id, ex.detail)
+        except Exception as ex:
+            log.exception(f"Ошибка обработки события MR {mr_id}, project {project_id} -> [{ex}]")
+
+    async def _review_once(self, project_id: int, mr_id: int, project_attrs: dict | None) -> MrSetupAnswer:
+        while True:
+            owner, outcome = await self._run_io(self.ledger.begin, project_id, mr_id)
+            if outcome is not None:
+                throttled.info("Запрос по MR {}, project {} уже обработан, возвращаем сохраненный результат",
+                               mr_id, project_id)
+                REVIEW_OUTCOMES.labels(str(outcome.status), "replay").inc()
+                return self._replay(outcome)
+            if owner:
+                break
+            await asyncio.sleep(self.LEDGER_POLL_INTERVAL)
+
+        try:
+            answer = await self.setup_review(project_id, mr_id, project_attrs)
+        except HTTPException as ex:
+            REVIEW_OUTCOMES.labels(str(ex.status_code), getattr(ex, "reason", "http")).inc()
+            await self._run_io(self.ledger.complete, project_id, mr_id,
+                               ReviewOutcome(status=ex.status_code, detail=ex.detail))
+            raise
+        except BaseException:
+            REVIEW_OUTCOMES.labels("500", "error").inc()
+            await self._run_io(self.ledger.release, project_id, mr_id)
+            raise
+        REVIEW_OUTCOMES.labels("200", "ok").inc()
+        await self._run_io(self.ledger.complete, project_id, mr_id, ReviewOutcome(status=200, answer=answer.json()))
+        return answer
+
+    @staticmethod
+    def _replay(outcome: ReviewOutcome) -> MrSetupAnswer:
+        if outcome.answer is not None:
+            return MrSetupAnswer.parse_raw(outcome.answer)
+        raise HTTPException(status_code=outcome.status, detail=outcome.detail)
+
+    async def setup_review(self, project_id: int, mr_id: int, project_attrs: dict | None = None) -> MrSetupAnswer:
+        mr: ProjectMergeRequest
+        project: Project
+        with stage("get_mr"):
+            mr, project = await self.git_service.get_mr(mr_id=mr_id, project_id=project_id,
+                                                        project_attrs=project_attrs)
+
+        if not mr:
+            log.error("Ошибка загрузки MR")
+            raise HTTPException(status_code=404, detail=f"MR {mr_id} в проекте {project_id} не найден")
+
+        mr_ref = mr.references["full"]
+        log.debug("MR -> {}", mr)
+        log.debug("Проект -> {}", project)
+
+        if len(mr.reviewers) > 0:
+            log.error("Повторный запрос на установку code-review пропущен")
+            raise ReviewSkipped("has_reviewers")
+
+        if 'NoCodeReview' in mr.labels:
+            log.info(f"MR [{mr_ref}] пропущен в соответствии с действующими исключениями фильтрами")
+            log.warning(f"Для MR {mr_id} в проекте {project_id} установлен флаг 'NoCodeReview'")
+            raise ReviewSkipped("no_code_review")
+
+        with stage("get_changes"):
+            diffs = await self.git_service.get_commit_info(mr)
+        log.debug("Изменения MR -> {}", diffs)
+
+        if self.git_service.check_project_exceptions(project.path_with_namespace) or diffs.count() == 0:
+            log.info(f"MR [{mr_ref}] пропущен в соответствии с действующими исключениями фильтрами")
+            raise ReviewSkipped("excluded")
+
+        log.debug("По запрошенному MR с учетом фильтров найдено {} изменений", diffs.count())
+
+        with stage("select_reviewers"):
+            # Выбор учитывает нагрузку ревьюверов, которая может быть перечитана из SQLite
+            reviewers, override_group = await self._run_io(self.team_service.get_random_reviewer_for_user,
+                                                           mr.author["username"], project.path_with_namespace,
+                                                           diffs.paths())
+
+        if not reviewers:
+            log.warning(f"Для MR [{mr_ref}] не удалось выбрать ревьювера")
+            raise ReviewSkipped("no_reviewer")
+
+        throttled.info("Для MR [{}] выбран ревьювер {}", mr_ref, reviewers)
+
+        if self.debug_mr_setup:
+            raise HTTPException(status_code=200, detail="DEBUG_MR_SETUP=true")
+
+        # Автор может не состоять в командах, если ревьюверы выбраны по override или владельцам путей
+        user: dict | None = self.team_service.get_user_by_username(mr.author['username'])
+        author = user["info"] if user else GitUser(id=mr.author["id"], name=mr.author.get("name"),
+                                                   uname=mr.author["username"], avatar_url=mr.author.get("avatar_url"),
+                                                   web_url=mr.author.get("web_url"))
+        team: Group = self.team_service.get_review_team(user["team"] if user else None, reviewers, override_group)
+
+        # Журнал ревью общий только для воркеров пода: повторный запрос, принятый другим подом, мог назначить
+        # ревьюверов, пока выбирались свои. Окно гонки сужается до создания обсуждений и сохранения MR
+        with stage("recheck_mr"):
+            if await self.git_service.has_reviewers(mr):
+                log.warning(f"Ревьюверы MR [{mr_ref}] назначены параллельным запросом, настройка пропущена")
+                raise ReviewSkipped("has_reviewers")
+
+        with stage("set_mr_review"):
+            set_mr_setting_result: MrCrResultData = await self.git_service.set_mr_review_setting(reviewers,
+                                                                                                 author,
+                                                                                                 team,
+                                                                                                 override_group,
+                                                                                                 mr,
+                                                                                                 project, diffs)
+        if not set_mr_setting_result:
+            log.error("Ошибка сохранения значений для MR")
+            raise HTTPException(status_code=500, detail="Ошибка сохранения значений для MR")
+
+        log.debug("Result -> {}", set_mr_setting_result)
+        await self._run_io(self.team_service.record_assignment, project_id, mr_id, reviewers)
+        with stage("outbox_put"):
+            await self._run_io(self.outbox.put, set_mr_setting_result)
+        self.dispatcher.notify()
+        return MrSetupAnswer.parse_obj(set_mr_setting_result)
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from .metrics import HTTP_CLIENT_SECONDS
+from .tracing import span
+
+
+class RetryStats:
+    """Счетчики повторных запросов по причине (HTTP-статус или тип ошибки соединения)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._retries = Counter()
+
+    def record(self, reason: str):
+        with self._lock:
+            self._retries[reason] += 1
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._retries)
+
+
+class RateLimitRetry(Retry):
+    """Повтор с экспоненциальной задержкой и jitter.
+
+    Идемпотентные запросы повторяются при ошибках соединения и 5xx, любые (включая POST) - при 429.
+    Задержка берется из Retry-After, а для 429 - также из RateLimit-Reset (Gitlab, unix time) или
+    X-RateLimit-Reset (Mattermost, сек).
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, *args, stats: RetryStats | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+
+    def new(self, **kwargs) -> "RateLimitRetry":
+        retry = super().new(**kwargs)
+        retry.stats = self.stats
+        return retry
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        # Заголовки RateLimit-* Gitlab и Mattermost передают и в ответах, не связанных с лимитом (например, 503):
+        # ожидание сброса окна лимита имеет смысл только для 429
+        if retry_after is None and response.status == 429:
+            retry_after = self._parse_reset(response.headers)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.backoff_max)
+
+    @staticmethod
+    def _parse_reset(headers) -> float | None:
+        reset = headers.get("RateLimit-Reset")
+        if reset and reset.isdigit():
+            return max(int(reset) - time.time(), 0)
+        reset = headers.get("X-RateLimit-Reset")
+        if reset and reset.isdigit():
+            return float(reset)
+        reset = headers.get("RateLimit-ResetTime")
+        if reset:
+            try:
+                return max(parsedate_to_datetime(reset).timestamp() - time.time(), 0)
+            except (TypeError, ValueError):
+                return None
+        return None
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        reason = str(response.status) if response is not None and response.status else type(error).__name__
+        try:
+            retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        except MaxRetryError:
+            self._record("exhausted")
+            raise
+        self._record(reason)
+        return retry
+
+    def _record(self, reason: str):
+        if self.stats is not None:
+            self.stats.record(reason)
+
+
+class PooledSession(requests.Session):
+    """Сессия requests с пулом keep-alive соединений, повторами запросов и таймаутом по умолчанию."""
+
+    def __init__(self, name: str, pool_size: int, retries: int, backoff_factor: float, backoff_max: float,
+                 timeout: float):
+        super().__init__()
+        self.name = name
+        self.timeout = timeout
+        self.retry_stats = RetryStats()
+        retry = RateLimitRetry(total=retries,
+                               status_forcelist=RateLimitRetry.RETRY_STATUSES,
+                               backoff_factor=backoff_factor,
+                               backoff_max=backoff_max,
+                               backoff_jitter=backoff_factor,
+                               respect_retry_after_header=True,
+                               raise_on_status=False,
+                               stats=self.retry_stats)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with span("http.client", f"{method.upper()} {self.name}", **{"url.path": urlsplit(url).path}):
+                response = super().request(method, url, **kwargs)
+            status = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            HTTP_CLIENT_SECONDS.labels(self.name, method.upper(), status).observe(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        pools = []
+        for adapter in {id(adapter): adapter for adapter in self.adapters.values()}.values():
+            manager = adapter.poolmanager
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append({"host": pool.host,
+                              "connections": pool.num_connections,
+                              "requests": pool.num_requests,
+                              "idle": pool.pool.qsize() if pool.pool else 0,
+                              "maxsize": pool.pool.maxsize if pool.pool else 0})
+        return {"pools": pools, "retries": self.retry_stats.snapshot()}
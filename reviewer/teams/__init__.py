@@ -1,2 +1,4 @@
 from .git import Git
 from .team import Team
+from .sync import ConfigSync
+from .load import ReviewLoad
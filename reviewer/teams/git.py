@@ -1,18 +1,32 @@
-import base64
-import sys
+import asyncio
+import contextvars
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 import gitlab
 import yaml
-from gitlab.exceptions import GitlabAuthenticationError, GitlabGetError, GitlabCreateError
+from gitlab.exceptions import GitlabAuthenticationError, GitlabCreateError, GitlabHttpError, GitlabError
 from gitlab.v4.objects import ProjectMergeRequest
 from loguru import logger as log
 from pydantic import parse_obj_as
 from yaml.parser import ParserError
 from yaml.scanner import ScannerError
 
-from reviewer.config import InitConfig
+from reviewer.config import InitConfig, DiffMode
+from reviewer.metrics import stage
+from reviewer.sessions import PooledSession
 from reviewer.utilites import render_template
+from .matchers import SkipMatcher, ProjectRouter
 from .schemas import GitUser, MrDiffList, MrDiff, MrCrResultData, Group, Override
+from .users import UserDirectory
+
+
+class _SessionGitlab(gitlab.Gitlab):
+    """Повторы запросов (в том числе 429) выполняет сессия PooledSession, собственные повторы python-gitlab отключены."""
+
+    def http_request(self, *args, max_retries: int = 0, **kwargs):
+        return super().http_request(*args, max_retries=max_retries, **kwargs)
 
 
 def _create_discussion_threads(reviewers: list[GitUser], team: Group, mr: ProjectMergeRequest):
@@ -67,73 +81,125 @@ def _build_mr_cr_result_data(
 class Git:
     init_cfg: InitConfig
     gl: gitlab.client.Gitlab
+    users: UserDirectory
+    session: PooledSession
     config: dict
+    skip: SkipMatcher
+    exclude: ProjectRouter
     _config_sha256: str = ""
+    _config_project: gitlab.v4.objects.projects.Project | None = None
+    _executor: ThreadPoolExecutor
+
+    # Максимум Gitlab API: в памяти держится одна страница, число запросов к Gitlab минимально
+    DIFF_PAGE_SIZE = 100
 
     def __init__(self, init_cfg: InitConfig):
         self.cfg = init_cfg
-        self.gl: gitlab.client.Gitlab = gitlab.Gitlab(url=init_cfg.GITLAB_URL, private_token=init_cfg.GITLAB_TOKEN)
+        self._executor = ThreadPoolExecutor(max_workers=init_cfg.GITLAB_IO_WORKERS, thread_name_prefix="gitlab-io")
+        self.session = PooledSession(name="gitlab",
+                                     pool_size=init_cfg.HTTP_POOL_SIZE,
+                                     retries=init_cfg.HTTP_RETRIES,
+                                     backoff_factor=init_cfg.HTTP_BACKOFF_FACTOR,
+                                     backoff_max=init_cfg.HTTP_BACKOFF_MAX,
+                                     timeout=init_cfg.GITLAB_TIMEOUT)
+        self.gl: gitlab.client.Gitlab = _SessionGitlab(url=init_cfg.GITLAB_URL, private_token=init_cfg.GITLAB_TOKEN,
+                                                       session=self.session, timeout=init_cfg.GITLAB_TIMEOUT)
+        self.users = UserDirectory(self.gl,
+                                   ttl=init_cfg.GITLAB_USER_CACHE_TTL,
+                                   maxsize=init_cfg.GITLAB_USER_CACHE_SIZE,
+                                   concurrency=init_cfg.GITLAB_USER_FETCH_CONCURRENCY)
+
+    def connect(self) -> bool:
         try:
             self.gl.auth()
-            log.info(f"Модуль успешно подключен к {init_cfg.GITLAB_URL}")
+            log.info(f"Модуль успешно подключен к {self.cfg.GITLAB_URL}")
+            return True
         except (GitlabAuthenticationError, Exception) as ex:
-            log.error(f"Ошибка подключения к ресурсу {init_cfg.GITLAB_URL} -> [{ex}]")
-            sys.exit()
-        self.load_config()
+            log.error(f"Ошибка подключения к ресурсу {self.cfg.GITLAB_URL} -> [{ex}]")
+            return False
+
+    async def run_io(self, func, *args, **kwargs):
+        """Выполняет блокирующий вызов python-gitlab в пуле потоков, не занимая event loop."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    def _get_config_project(self) -> gitlab.v4.objects.projects.Project:
+        if self._config_project is None:
+            self._config_project = self.gl.projects.get(self.cfg.TEAM_CONFIG_PROJECT, lazy=True)
+        return self._config_project
 
-    def load_config(self) -> bool:
-        project = self.gl.projects.get(self.cfg.TEAM_CONFIG_PROJECT)
+    def fetch_config(self) -> tuple[dict, str] | None:
+        """Загружает конфигурацию команд и ее sha256, если файл изменился (HEAD-запрос), иначе возвращает None.
+
+        Загруженная конфигурация применяется через apply_config после успешной сборки состояния команд.
+        """
         try:
-            _config_sha256 = project.files.get(file_path=self.cfg.TEAM_CONFIG_FILE,
-                                               ref=self.cfg.TEAM_CONFIG_BRANCH).content_sha256
+            project = self._get_config_project()
+            headers = project.files.head(self.cfg.TEAM_CONFIG_FILE, query_data={"ref": self.cfg.TEAM_CONFIG_BRANCH})
+            _config_sha256 = headers["X-Gitlab-Content-Sha256"]
             if _config_sha256 != self._config_sha256:
                 if self._config_sha256:
                     log.warning("Обнаружена свежая версия конфига. Загружаем!")
-                config_encoded = project.files.get(file_path=self.cfg.TEAM_CONFIG_FILE,
-                                                   ref=self.cfg.TEAM_CONFIG_BRANCH).content
-                config_decoded = base64.b64decode(config_encoded).decode()
-                self.config = yaml.safe_load(config_decoded)
-                self._config_sha256 = _config_sha256
-                log.info("Конфигурация успешно загружена")
-                log.debug(self.config)
-                return True
+                config_decoded = project.files.raw(file_path=self.cfg.TEAM_CONFIG_FILE,
+                                                   ref=self.cfg.TEAM_CONFIG_BRANCH).decode()
+                config = yaml.safe_load(config_decoded)
+                log.debug("Конфигурация команд -> {}", config)
+                return config, _config_sha256
             else:
-                return False
-        except (GitlabGetError, ScannerError, ParserError) as ex:
+                return None
+        except (GitlabError, ScannerError, ParserError, KeyError) as ex:
             log.error(
                 f"Ошибка загрузки файла командной конфигурации ({self.cfg.TEAM_CONFIG_FILE}) в проекте "
                 f"{self.cfg.GITLAB_URL}/{self.cfg.TEAM_CONFIG_PROJECT} -> [{ex}]")
-            sys.exit()
-
-    def get_user_data(self, username: str) -> GitUser | None:
-        if not username:
-            return None
-        user = self.gl.users.list(username=username.strip())
-
-        if user and user[0].state == "active":
-            udata = GitUser(id=user[0].id,
-                            name=user[0].name,
-                            uname=user[0].username,
-                            avatar_url=user[0].avatar_url,
-                            web_url=user[0].web_url)
-            return udata
-        else:
             return None
 
-    def check_project_exceptions(self, project) -> bool:
-        try:
-            exclude_project_option = self.config["projects"]["exclude"]
-        except KeyError:
-            exclude_project_option = None
-        if exclude_project_option is None or project not in exclude_project_option:
+    def is_config_push(self, event: dict) -> bool:
+        """Проверяет, затрагивает ли push-событие Gitlab файл командной конфигурации."""
+        project = event.get("project") or {}
+        config_project = self.cfg.TEAM_CONFIG_PROJECT.strip("/").lower()
+        if config_project not in (str(event.get("project_id")), str(project.get("path_with_namespace")).lower()):
             return False
-        else:
+        if event.get("ref") != f"refs/heads/{self.cfg.TEAM_CONFIG_BRANCH}":
+            return False
+        commits = event.get("commits") or []
+        # Gitlab передает в событии не более 20 коммитов, по остальным изменения неизвестны
+        if event.get("total_commits_count", len(commits)) > len(commits):
             return True
+        return any(self.cfg.TEAM_CONFIG_FILE in commit.get(key, [])
+                   for commit in commits for key in ("added", "modified", "removed"))
+
+    def apply_config(self, config: dict, config_sha256: str):
+        skip = SkipMatcher.from_config(config["projects"].get("skip"))
+        exclude = self._build_exclude_router(config)
+        self.config, self.skip, self.exclude, self._config_sha256 = config, skip, exclude, config_sha256
+
+    @property
+    def config_sha256(self) -> str:
+        return self._config_sha256
 
-    def get_mr_info(self, project_id: int, mr_id: int) -> [ProjectMergeRequest | None,
-                                                           gitlab.v4.objects.projects.Project | None]:
+    def resolve_users(self, usernames, refresh=()) -> dict[str, GitUser | None]:
+        return self.users.resolve(usernames, refresh)
+
+    @staticmethod
+    def _build_exclude_router(config: dict) -> ProjectRouter:
+        router = ProjectRouter()
+        for project in config["projects"].get("exclude") or []:
+            router.add(project)
+        return router
+
+    def check_project_exceptions(self, project) -> bool:
+        return self.exclude.get(project, False)
+
+    def get_mr_info(self, project_id: int, mr_id: int, project_attrs: dict | None = None) -> [
+            ProjectMergeRequest | None, gitlab.v4.objects.projects.Project | None]:
+        """Загружает MR. Если переданы атрибуты проекта (из события Gitlab), проект повторно не загружается."""
         try:
-            project: gitlab.v4.objects.projects.Project = self.gl.projects.get(project_id, lazy=False)
+            project: gitlab.v4.objects.projects.Project
+            if project_attrs and project_attrs.get("id") == project_id:
+                project = gitlab.v4.objects.projects.Project(self.gl.projects, project_attrs)
+            else:
+                project = self.gl.projects.get(project_id, lazy=False)
             mr: ProjectMergeRequest = project.mergerequests.get(mr_id)
             if mr and mr.state != "closed":
                 return mr, project
@@ -142,12 +208,63 @@ class Git:
         except gitlab.exceptions.GitlabGetError:
             return None, None
 
+    def has_reviewers(self, mr: ProjectMergeRequest) -> bool:
+        """Проверяет по актуальному состоянию MR в Gitlab, назначены ли ревьюверы (например, другим подом)."""
+        return bool(self.gl.http_get(f"{mr.manager.path}/{mr.iid}").get("reviewers"))
+
+    def get_project_attrs(self, project_id: int) -> dict | None:
+        try:
+            return self.gl.projects.get(project_id).attributes
+        except gitlab.exceptions.GitlabGetError:
+            return None
+
+    def list_unreviewed_mrs(self, project: str | None = None, group: str | None = None,
+                            limit: int | None = None) -> list[tuple[int, int]] | None:
+        """Возвращает (project_id, iid) открытых MR без ревьюверов в проекте или группе (включая подгруппы),
+        не более limit. None - проект или группа не найдены."""
+        if project:
+            manager = self.gl.projects.get(project, lazy=True).mergerequests
+        else:
+            manager = self.gl.groups.get(group, lazy=True).mergerequests
+        try:
+            mrs = manager.list(state="opened", reviewer_id="None", iterator=True, per_page=100)
+            return [(mr.project_id, mr.iid) for mr in itertools.islice(mrs, limit)]
+        except (gitlab.exceptions.GitlabGetError, gitlab.exceptions.GitlabListError):
+            return None
+
+    def list_open_reviews(self, user_ids: list[int]) -> list[tuple[int, int, int]]:
+        """Возвращает (user_id, project_id, iid) открытых MR, в которых пользователи назначены ревьюверами."""
+        reviews = []
+        for user_id in user_ids:
+            for mr in self.gl.mergerequests.list(scope="all", state="opened", reviewer_id=user_id, iterator=True,
+                                                 per_page=100):
+                reviews.append((user_id, mr.project_id, mr.iid))
+        return reviews
+
     def get_commits_info(self, mr: ProjectMergeRequest) -> MrDiffList:
+        if self.cfg.GITLAB_DIFF_MODE == DiffMode.FULL:
+            return self._get_full_diffs(mr)
+
+        diffs = MrDiffList()
+        try:
+            for v in self.gl.http_list(f"{mr.manager.path}/{mr.iid}/diffs", iterator=True, per_page=self.DIFF_PAGE_SIZE):
+                d = MrDiff(new_path=v["new_path"], diff_size=len(v["diff"]))
+                diffs.append(d, self.skip)
+        except GitlabHttpError as ex:
+            if ex.response_code != 404:
+                raise
+            log.warning("Gitlab не поддерживает постраничную загрузку изменений MR, используется /changes")
+            diffs = MrDiffList()
+            for d in self._get_full_diffs(mr).diffs:
+                diffs.diffs.append(MrDiff(new_path=d.new_path, diff_size=d.diff_size))
+        return diffs
+
+    def _get_full_diffs(self, mr: ProjectMergeRequest) -> MrDiffList:
         changes = mr.changes()
         diffs = MrDiffList()
         for v in changes["changes"]:
             d: MrDiff = parse_obj_as(MrDiff, v)
-            diffs.append(d, self.config["projects"]["skip"])
+            diffs.append(d, self.skip)
         return diffs
 
     def set_mr_review_setting(
@@ -166,9 +283,11 @@ class Git:
 
             mr.discussion_locked = False
 
-            _create_discussion_threads(reviewers, team, mr)
+            with stage("discussions"):
+                _create_discussion_threads(reviewers, team, mr)
 
-            res = mr.save()
+            with stage("mr_save"):
+                res = mr.save()
 
             if res:
                 log.info(f"Настройки для MR {mr.references['full']} установлены")
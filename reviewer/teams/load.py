@@ -0,0 +1,168 @@
+import heapq
+import os
+import random
+import sqlite3
+import threading
+from collections import Counter
+from typing import Collection
+
+from .schemas import GitUser
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_load (
+    user_id INTEGER NOT NULL,
+    project_id INTEGER NOT NULL,
+    mr_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, project_id, mr_id)
+);
+CREATE INDEX IF NOT EXISTS review_load_mr ON review_load (project_id, mr_id);
+"""
+
+
+class ReviewLoad:
+    """Количество открытых ревью у каждого ревьювера. Хранится в SQLite (WAL), общем для всех воркеров пода.
+    Поды считают нагрузку независимо, их счетчики совпадают только после сверки с Gitlab (reconcile).
+
+    Счетчики держатся в памяти и перечитываются из базы, только если ее изменил другой воркер (PRAGMA data_version).
+    Для этого все потоки процесса работают с базой через одно соединение под self._lock: собственные записи
+    не меняют data_version. Файл базы не должен использоваться другими таблицами (например, журналом ревью):
+    data_version меняется при любой записи в файл. generation увеличивается при любом уменьшении нагрузки или перечитывании счетчиков.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.RLock()
+        self._connection: sqlite3.Connection | None = None
+        self._connection_pid = None
+        self._counts: Counter = Counter()
+        self._data_version = None
+        self.generation = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            self._conn().executescript(_SCHEMA)
+        self.refresh()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение процесса. Вызывается только под self._lock."""
+        if self._connection_pid != os.getpid():
+            conn = sqlite3.connect(self._path, isolation_level=None, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._connection, self._connection_pid, self._data_version = conn, os.getpid(), None
+        return self._connection
+
+    def refresh(self):
+        """Перечитывает счетчики, если база изменена другим воркером."""
+        with self._lock:
+            conn = self._conn()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            rows = conn.execute("SELECT user_id, COUNT(*) FROM review_load GROUP BY user_id").fetchall()
+            self._counts = Counter(dict(rows))
+            self._data_version = data_version
+            self.generation += 1
+
+    def count(self, user_id: int) -> int:
+        return self._counts[user_id]
+
+    def assign(self, project_id: int, mr_id: int, user_ids: list[int]):
+        with self._lock:
+            conn = self._conn()
+            for user_id in user_ids:
+                cur = conn.execute("INSERT OR IGNORE INTO review_load (user_id, project_id, mr_id) VALUES (?, ?, ?)",
+                                   (user_id, project_id, mr_id))
+                self._counts[user_id] += cur.rowcount
+
+    def release(self, project_id: int, mr_id: int) -> int:
+        """Снимает нагрузку по закрытому или слитому MR. Возвращает количество освобожденных ревьюверов."""
+        with self._lock:
+            conn = self._conn()
+            rows = conn.execute("SELECT user_id FROM review_load WHERE project_id = ? AND mr_id = ?",
+                                (project_id, mr_id)).fetchall()
+            if not rows:
+                return 0
+            conn.execute("DELETE FROM review_load WHERE project_id = ? AND mr_id = ?", (project_id, mr_id))
+            for (user_id,) in rows:
+                self._counts[user_id] -= 1
+            self.generation += 1
+            return len(rows)
+
+    def reconcile(self, open_reviews: list[tuple[int, int, int]]):
+        """Заменяет счетчики фактическими данными Gitlab: список (user_id, project_id, mr_id) открытых ревью."""
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM review_load")
+                conn.executemany("INSERT OR IGNORE INTO review_load (user_id, project_id, mr_id) VALUES (?, ?, ?)",
+                                 open_reviews)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._counts = Counter(user_id for user_id, _, _ in set(open_reviews))
+            self.generation += 1
+
+    def stats(self) -> dict[int, int]:
+        return dict(self._counts)
+
+
+class ReviewerPool:
+    """Кандидаты в ревьюверы команды или override-блока, упорядоченные по нагрузке с учетом веса.
+
+    Куча с ленивым обновлением: запись с устаревшим счетчиком исправляется при извлечении, поэтому выбор k ревьюверов
+    стоит O(k log n). Куча перестраивается целиком, только когда нагрузка уменьшилась (изменился generation).
+    """
+
+    def __init__(self, reviewers: list[GitUser], weights: dict[str, float] | None = None):
+        weights = weights or {}
+        self._reviewers = {rev.id: rev for rev in reviewers}
+        self._weights = {rev.id: float(weights.get(rev.uname, 1)) or 1.0 for rev in reviewers}
+        self._heap: list[tuple[float, float, int, int]] = []
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._reviewers)
+
+    @property
+    def reviewers(self) -> list[GitUser]:
+        return list(self._reviewers.values())
+
+    def available(self, exclude: Collection[str] = ()) -> int:
+        return sum(1 for rev in self._reviewers.values() if rev.uname not in exclude)
+
+    def _entry(self, user_id: int, load: ReviewLoad | None) -> tuple[float, float, int, int]:
+        count = load.count(user_id) if load else 0
+        return (count + 1) / self._weights[user_id], random.random(), user_id, count
+
+    def select(self, quantity: int, exclude: Collection[str] = (), load: ReviewLoad | None = None) -> list[GitUser]:
+        """Выбирает quantity наименее загруженных ревьюверов, исключая exclude. Равные по нагрузке выбираются случайно."""
+        with self._lock:
+            if load is not None:
+                load.refresh()
+            generation = load.generation if load else 0
+            if generation != self._generation:
+                self._heap = [self._entry(user_id, load) for user_id in self._reviewers]
+                heapq.heapify(self._heap)
+                self._generation = generation
+
+            selected, skipped = [], []
+            while self._heap and len(selected) < quantity:
+                entry = heapq.heappop(self._heap)
+                user_id, count = entry[2], entry[3]
+                if load is not None and load.count(user_id) != count:
+                    heapq.heappush(self._heap, self._entry(user_id, load))
+                    continue
+                if self._reviewers[user_id].uname in exclude:
+                    skipped.append(entry)
+                else:
+                    selected.append(user_id)
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+            for user_id in selected:
+                heapq.heappush(self._heap, self._entry(user_id, load))
+            return [self._reviewers[user_id] for user_id in selected]
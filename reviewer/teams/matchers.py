@@ -0,0 +1,198 @@
+import fnmatch
+import re
+from typing import Any
+
+_GLOB_CHARS = frozenset("*?[")
+
+
+class _Node:
+    __slots__ = ("children", "globs", "deep", "values")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.globs: list[tuple[re.Pattern, _Node]] = []
+        self.deep: _Node | None = None
+        self.values: list[tuple[int, Any]] = []
+
+
+class PathPatternTrie:
+    """Префиксное дерево glob-шаблонов путей (синтаксис .gitignore/CODEOWNERS), разобранных по сегментам.
+
+    Шаблон без "/" (кроме завершающего) сопоставляется с именем на любой глубине, "dir/" - со всем содержимым
+    каталога, "**" - с любым количеством сегментов. Завершающий "**" ("dir/**") требует хотя бы одного сегмента:
+    шаблон совпадает с содержимым каталога, но не с самим "dir".
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, pattern: str, value: Any = True):
+        node = self._root
+        for segment in self._split(pattern):
+            if segment == "**":
+                if node.deep is None:
+                    node.deep = _Node()
+                node = node.deep
+            elif _GLOB_CHARS.intersection(segment):
+                regex = re.compile(fnmatch.translate(segment))
+                for existing, child in node.globs:
+                    if existing.pattern == regex.pattern:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.globs.append((regex, child))
+                    node = child
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.values.append((self._count, value))
+        self._count += 1
+
+    @staticmethod
+    def _split(pattern: str) -> list[str]:
+        pattern = pattern.strip()
+        directory = pattern.endswith("/")
+        anchored = "/" in pattern.rstrip("/")
+        segments = [segment for segment in pattern.split("/") if segment]
+        if not anchored and segments[:1] != ["**"]:
+            segments.insert(0, "**")
+        if directory:
+            segments.append("**")
+        if segments[-1] == "**":
+            # "*" - ровно один сегмент, за ним любое количество: путь внутри каталога, а не сам каталог
+            segments[-1:] = ["*", "**"]
+        return segments
+
+    def match(self, path: str) -> list[Any]:
+        """Возвращает значения всех совпавших шаблонов в порядке их добавления."""
+        found: dict[int, Any] = {}
+        if self._count:
+            self._walk(self._root, path.strip("/").split("/"), 0, found)
+        return [found[order] for order in sorted(found)]
+
+    def _walk(self, node: _Node, segments: list[str], index: int, found: dict[int, Any]):
+        if node.deep is not None:
+            for next_index in range(index, len(segments) + 1):
+                self._walk(node.deep, segments, next_index, found)
+        if index == len(segments):
+            found.update(node.values)
+            return
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            self._walk(child, segments, index + 1, found)
+        for regex, child in node.globs:
+            if regex.match(segment):
+                self._walk(child, segments, index + 1, found)
+
+
+class SkipMatcher:
+    """Скомпилированные правила projects.skip: точные пути, расширения и glob-шаблоны."""
+
+    def __init__(self, extensions: list[str] = None, files: list[str] = None, patterns: list[str] = None):
+        self._extensions = {ext.strip().lower().lstrip(".") for ext in extensions or []}
+        self._files = {name.strip().lower() for name in files or []}
+        self._patterns = PathPatternTrie()
+        for pattern in patterns or []:
+            self._patterns.add(pattern.lower())
+
+    @classmethod
+    def from_config(cls, skip: dict | None) -> "SkipMatcher":
+        skip = skip or {}
+        return cls(extensions=skip.get("extensions"), files=skip.get("files"), patterns=skip.get("patterns"))
+
+    def match(self, path: str) -> bool:
+        path = path.lower()
+        if path in self._files:
+            return True
+        if self._extensions:
+            name = path.rsplit("/", 1)[-1]
+            dot = name.find(".")
+            while dot != -1:
+                if name[dot + 1:] in self._extensions:
+                    return True
+                dot = name.find(".", dot + 1)
+        return bool(self._patterns.match(path))
+
+
+class ProjectRouter:
+    """Индекс проектов: хэш-таблица точных путей и префиксное дерево групп вида "group/subgroup/*".
+
+    Точный путь имеет приоритет над группой, из нескольких групп выбирается самая глубокая.
+    При повторном указании проекта или группы действует первое вхождение.
+    """
+
+    def __init__(self):
+        self._exact: dict[str, Any] = {}
+        self._namespaces: dict[str, dict] = {}
+
+    def add(self, path: str, value: Any = True):
+        path = path.strip().strip("/").lower()
+        namespace = path.removesuffix("/**").removesuffix("/*")
+        if namespace == path:
+            self._exact.setdefault(path, value)
+            return
+        nodes = self._namespaces
+        node = None
+        for segment in namespace.split("/"):
+            node = nodes.setdefault(segment, {"children": {}})
+            nodes = node["children"]
+        node.setdefault("value", value)
+
+    def get(self, project: str, default: Any = None) -> Any:
+        project = project.strip().strip("/").lower()
+        if project in self._exact:
+            return self._exact[project]
+        found = default
+        nodes = self._namespaces
+        segments = project.split("/")
+        for segment in segments[:-1]:
+            node = nodes.get(segment)
+            if node is None:
+                break
+            found = node.get("value", found)
+            nodes = node["children"]
+        return found
+
+    def values(self) -> list[Any]:
+        """Значения всех проектов и групп индекса."""
+        values = list(self._exact.values())
+        stack = list(self._namespaces.values())
+        while stack:
+            node = stack.pop()
+            if "value" in node:
+                values.append(node["value"])
+            stack.extend(node["children"].values())
+        return values
+
+
+class OwnershipMap:
+    """Правила владения путями в стиле CODEOWNERS: для каждого пути действует последнее совпавшее правило."""
+
+    def __init__(self):
+        self._patterns = PathPatternTrie()
+        self._owners: list[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def add(self, pattern: str, owners: Any):
+        self._patterns.add(pattern, len(self._owners))
+        self._owners.append(owners)
+
+    def owners(self) -> list[Any]:
+        return list(self._owners)
+
+    def match(self, paths) -> list[Any]:
+        """Возвращает владельцев измененных путей без повторов: сначала правила, совпавшие с большим числом путей,
+        при равенстве - в порядке первого совпадения."""
+        found: dict[int, int] = {}
+        for path in paths:
+            rules = self._patterns.match(path)
+            if rules:
+                found[rules[-1]] = found.get(rules[-1], 0) + 1
+        return [self._owners[rule] for rule in sorted(found, key=found.get, reverse=True)]
@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Any
 
 from pydantic import BaseModel, Extra, HttpUrl, root_validator
 
+from .matchers import SkipMatcher
+
 
 class GitUser(BaseModel):
     id: int
@@ -23,6 +25,7 @@ class Group(BaseModel):
     lead: Optional[GitUser]
     assignee: Optional[GitUser]
     reviewers: list[GitUser]
+    weights: dict[str, float] = {}
 
 
 class Override(BaseModel):
@@ -31,6 +34,7 @@ class Override(BaseModel):
     channel: Optional[str]
     components: List[str]
     reviewers: List[GitUser]
+    weights: dict[str, float] = {}
 
 
 class MrInfo(BaseModel):
@@ -38,13 +42,14 @@ class MrInfo(BaseModel):
 
 
 class MrDiff(BaseModel):
-    diff: str
+    diff: Optional[str]
     new_path: str
     diff_size: Optional[int]
 
     def __init__(self, **data):
         super().__init__(**data)
-        self.diff_size = len(self.diff)
+        if self.diff is not None:
+            self.diff_size = len(self.diff)
 
 
 class MrDiffList(BaseModel):
@@ -53,16 +58,17 @@ class MrDiffList(BaseModel):
     def count(self) -> int:
         return len(self.diffs)
 
+    def paths(self) -> list[str]:
+        return [diff.new_path for diff in self.diffs]
+
     def sum_diff_scope(self) -> int:
         scope = 0
         for diff in self.diffs:
             scope += diff.diff_size
         return scope
 
-    def append(self, item: MrDiff, skip: dict):
-        skip_extensions = tuple(skip["extensions"])
-        skip_files = tuple(skip["files"])
-        if not item.new_path.lower().endswith(skip_extensions) and item.new_path.lower() not in skip_files:
+    def append(self, item: MrDiff, skip: SkipMatcher):
+        if not skip.match(item.new_path):
             self.diffs.append(item)
 
 
@@ -98,3 +104,11 @@ class MrCrResultData(BaseModel):
         values['target_branch_link'] = f"{values.get('web_url')}/-/tree/{values.get('target_branch')}"
         values['diff_url'] = f"{values.get('mr_url')}/diffs"
         return values
+
+
+class ConfigSnapshot(BaseModel):
+    version: int
+    created_at: datetime
+    config_sha256: str
+    config: dict[str, Any]
+    users: dict[str, Optional[GitUser]]
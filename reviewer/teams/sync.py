@@ -0,0 +1,149 @@
+import fcntl
+import os
+import time
+
+from loguru import logger as log
+from pydantic import ValidationError
+
+from reviewer.metrics import CONFIG_RELOAD_SECONDS
+from reviewer.tracing import transaction
+from .schemas import ConfigSnapshot
+from .team import Team
+
+
+class ConfigSync:
+    """Синхронизация конфигурации команд между воркерами через версионированный снимок на диске.
+
+    Gitlab опрашивает только воркер, захвативший lock-файл. Он публикует снимок (конфигурация и данные
+    пользователей), остальные воркеры применяют его без обращений к Gitlab.
+    """
+
+    def __init__(self, team: Team, path: str):
+        self._team = team
+        self._path = path
+        self._lock_path = f"{path}.lock"
+        self._reload_path = f"{path}.reload"
+        self._polled_at = 0.0
+        self._lock_fd: int | None = None
+        self._snapshot_stat: tuple | None = None
+        self.version = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def _try_lead(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        log.info(f"Воркер {os.getpid()} отвечает за загрузку конфигурации команд из Gitlab")
+        return True
+
+    def load_persisted(self) -> bool:
+        """Применяет последний сохраненный снимок, если он есть. Не обращается к Gitlab."""
+        return self._load_snapshot()
+
+    def start(self, timeout: float = 60):
+        """Первичная загрузка: ведущий воркер загружает конфигурацию, остальные ждут снимок."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._try_lead():
+                self._load_snapshot()
+                self._polled_at = time.monotonic()
+                if self._update_config():
+                    self._publish()
+                return
+            if self._load_snapshot() or self.version:
+                return
+            if time.monotonic() > deadline:
+                log.warning("Снимок конфигурации не опубликован, загружаем конфигурацию самостоятельно")
+                self._team.update_config()
+                return
+            time.sleep(0.5)
+
+    def refresh(self) -> bool:
+        """Обновляет конфигурацию воркера. Возвращает True, если применена новая версия.
+
+        Ведущий воркер при неизменной конфигурации повторно запрашивает не найденных и устаревших пользователей.
+        """
+        if self._try_lead():
+            if self._update_config() or self._team.refresh_users():
+                self._publish()
+                return True
+            return False
+        return self._load_snapshot()
+
+    def request_refresh(self):
+        """Запрашивает внеочередную загрузку конфигурации из Gitlab у ведущего воркера этого пода.
+        Другие поды применяют изменения при очередном опросе Gitlab."""
+        with open(self._reload_path, "w"):
+            pass
+
+    def _consume_refresh_request(self) -> bool:
+        try:
+            os.remove(self._reload_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def tick(self, poll_interval: float) -> bool:
+        """Ведущий воркер опрашивает Gitlab раз в poll_interval или по запросу, остальные проверяют снимок на диске."""
+        if not self._try_lead():
+            return self._load_snapshot()
+        requested = self._consume_refresh_request()
+        if not requested and time.monotonic() - self._polled_at < poll_interval:
+            return False
+        if requested:
+            log.info("Внеочередная загрузка конфигурации по событию Gitlab")
+        self._polled_at = time.monotonic()
+        return self.refresh()
+
+    def _update_config(self) -> bool:
+        started = time.perf_counter()
+        with transaction("config.reload", "team config reload"):
+            changed = self._team.update_config()
+        CONFIG_RELOAD_SECONDS.labels(str(changed).lower()).observe(time.perf_counter() - started)
+        return changed
+
+    def _publish(self):
+        snapshot = self._team.snapshot(version=time.time_ns())
+        tmp_path = f"{self._path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(snapshot.json())
+        os.replace(tmp_path, self._path)
+        self._snapshot_stat = self._stat()
+        self.version = snapshot.version
+        log.info(f"Опубликован снимок конфигурации версии {snapshot.version}")
+
+    def _stat(self) -> tuple | None:
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load_snapshot(self) -> bool:
+        stat = self._stat()
+        if stat is None or stat == self._snapshot_stat:
+            return False
+        try:
+            snapshot = ConfigSnapshot.parse_file(self._path)
+        except (ValidationError, ValueError, OSError) as ex:
+            log.error(f"Ошибка чтения снимка конфигурации {self._path} -> [{ex}]")
+            return False
+        self._snapshot_stat = stat
+        if snapshot.version == self.version:
+            return False
+        self._team.apply_snapshot(snapshot)
+        self.version = snapshot.version
+        log.info(f"Применен снимок конфигурации версии {snapshot.version} от {snapshot.created_at}")
+        return True
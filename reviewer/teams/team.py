@@ -1,106 +1,290 @@
-import random
+import time
+from datetime import datetime
+from typing import NamedTuple
 
 import pydantic
 from loguru import logger as log
 
+from reviewer.tracing import span
 from .git import Git
-from .schemas import GitUser, Override, Group
+from .load import ReviewLoad, ReviewerPool
+from .matchers import ProjectRouter, OwnershipMap
+from .schemas import GitUser, Override, Group, ConfigSnapshot
 
 
-class Team:
-    _groups: dict[str, Group]
-    _members: dict
-    git: Git
-    _overrides: list[Override]
+class TeamState(NamedTuple):
+    """Неизменяемое состояние конфигурации команд. Публикуется целиком одной операцией присваивания."""
+    members: dict[str, dict]
+    groups: dict[str, Group]
+    group_pools: dict[str, ReviewerPool]
+    overrides: list[Override]
+    override_pools: dict[str, ReviewerPool]
+    override_router: ProjectRouter
+    owners_router: ProjectRouter
+    resolved: dict[str, GitUser | None]
+    resolved_at: dict[str, float]
+    team_configs: dict[str, dict]
+    override_configs: dict[str, dict]
 
-    def __init__(self, git: Git):
-        self.git = git
-        self._load_team_config()
-        self._load_override_config()
 
-    def update_config(self):
-        is_upd = self.git.load_config()
-        if is_upd:
-            self._load_team_config()
-            self._load_override_config()
+EMPTY_STATE = TeamState(members={}, groups={}, group_pools={}, overrides=[], override_pools={},
+                        override_router=ProjectRouter(), owners_router=ProjectRouter(), resolved={}, resolved_at={},
+                        team_configs={}, override_configs={})
+
 
-    def _load_override_config(self):
-        project_setup = self.git.config["projects"]["override"]
-        self._overrides = [self._create_override(name, val) for sets in project_setup for name, val in sets.items()]
+def _strip(names) -> list[str]:
+    return [name.strip() for name in names or [] if name and name.strip()]
+
+
+class Team:
+    git: Git
+    load: ReviewLoad | None
+    _state: TeamState
 
-    def _create_override(self, name, val):
-        users = [self.git.get_user_data(username=rev) for rev in val["reviewers"]]
+    def __init__(self, git: Git, load: ReviewLoad | None = None):
+        self.git = git
+        self.load = load
+        self._state = EMPTY_STATE
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.git.config_sha256)
+
+    def update_config(self) -> bool:
+        """Загружает конфигурацию из Gitlab. Конфигурация и ее sha256 сохраняются только вместе с состоянием команд:
+        при ошибке сборки состояния загрузка повторится при следующем опросе."""
+        with span("config.fetch", "load team config"):
+            fetched = self.git.fetch_config()
+        if fetched is None:
+            return False
+        config, config_sha256 = fetched
+        with span("config.apply", "apply team config"):
+            try:
+                state = self._build_state(config)
+                self.git.apply_config(config, config_sha256)
+            except (KeyError, TypeError) as ex:
+                log.error(f"Ошибка чтения командной конфигурации ({self.git.cfg.TEAM_CONFIG_FILE}) -> [{ex}]")
+                return False
+            self._state = state
+        log.info("Конфигурация успешно загружена")
+        return True
+
+    def refresh_users(self) -> bool:
+        """Повторно запрашивает пользователей, не найденных в Gitlab или загруженных раньше GITLAB_USER_CACHE_TTL,
+        без изменения конфигурации. Возвращает True, если данные пользователей изменились."""
+        state = self._state
+        if not self.loaded:
+            return False
+        usernames = self._config_usernames(*self._split_config(self.git.config))
+        if not self._expired_users(usernames, state.resolved, state.resolved_at):
+            return False
+        self._state = self._build_state(self.git.config)
+        return self._state.resolved != state.resolved
+
+    def apply_snapshot(self, snapshot: ConfigSnapshot):
+        """Применяет снимок конфигурации, опубликованный другим воркером, без запросов пользователей в Gitlab."""
+        self.git.users.seed(snapshot.users)
+        state = self._build_state(snapshot.config, known_users=snapshot.users,
+                                  known_at=snapshot.created_at.timestamp())
+        self.git.apply_config(snapshot.config, snapshot.config_sha256)
+        self._state = state
+
+    def snapshot(self, version: int) -> ConfigSnapshot:
+        return ConfigSnapshot(version=version,
+                              created_at=datetime.now(),
+                              config_sha256=self.git.config_sha256,
+                              config=self.git.config,
+                              users=self._state.resolved)
+
+    def _build_state(self, config: dict, known_users: dict[str, GitUser | None] | None = None,
+                     known_at: float | None = None) -> TeamState:
+        """Строит состояние по новой конфигурации, переиспользуя неизменившиеся команды и пользователей.
+
+        known_users - пользователи из снимка другого воркера (загружены в момент known_at), в Gitlab не запрашиваются.
+        """
+        previous = self._state
+        team_configs, override_configs, owners_configs = self._split_config(config)
+
+        self.git.users.reset_stats()
+        with span("config.resolve_users", "resolve gitlab users"):
+            if known_users is not None:
+                resolved = {name: known_users.get(name)
+                            for name in self._config_usernames(team_configs, override_configs, owners_configs)}
+                resolved_at = dict.fromkeys(resolved, known_at)
+            else:
+                resolved, resolved_at = self._resolve_users(team_configs, override_configs, owners_configs,
+                                                            previous.resolved, previous.resolved_at)
+
+        groups, group_pools, rebuilt = {}, {}, []
+        for name, info in team_configs.items():
+            group = previous.groups.get(name)
+            if group is None or not self._is_unchanged(info, previous.team_configs.get(name),
+                                                       self._team_usernames(info), resolved, previous.resolved):
+                group = self._build_group(name, info, resolved)
+                rebuilt.append(name)
+            if group:
+                groups[name] = group
+                group_pools[name] = previous.group_pools.get(name) if group is previous.groups.get(name) \
+                    else ReviewerPool(group.reviewers, group.weights)
+
+        overrides, override_pools, router = [], {}, ProjectRouter()
+        previous_overrides = {over.name: over for over in previous.overrides if over}
+        for name, val in override_configs.items():
+            over = previous_overrides.get(name)
+            if over is None or not self._is_unchanged(val, previous.override_configs.get(name),
+                                                      _strip(val.get("reviewers")), resolved, previous.resolved):
+                over = self._create_override(name, val, resolved)
+                rebuilt.append(name)
+            overrides.append(over)
+            if over:
+                override_pools[name] = previous.override_pools.get(name) if over is previous_overrides.get(name) \
+                    else ReviewerPool(over.reviewers, over.weights)
+                for component in over.components:
+                    router.add(component, over)
+
+        state = TeamState(members=self._build_members(team_configs, resolved),
+                          groups=groups,
+                          group_pools=group_pools,
+                          overrides=overrides,
+                          override_pools=override_pools,
+                          override_router=router,
+                          owners_router=self._build_owners(owners_configs, resolved),
+                          resolved=resolved,
+                          resolved_at=resolved_at,
+                          team_configs=team_configs,
+                          override_configs=override_configs)
+
+        stats = self.git.users.stats()
+        log.info(f"Конфигурация команд применена: перестроено блоков {len(rebuilt)} {rebuilt}, "
+                 f"пользователи Gitlab: из кэша {stats['hits']}, запросов в Gitlab {stats['misses']}")
+        log.debug("Результат загрузки пользователей из конфигурации: {}", state.members)
+        log.debug("Результат загрузки групп из конфигурации: {}", state.groups)
+        return state
+
+    @staticmethod
+    def _split_config(config: dict) -> tuple[dict, dict, dict]:
+        team_configs = {name: info for setup in config["teams"] for name, info in setup.items()}
+        override_configs = {name: val for sets in config["projects"]["override"] for name, val in sets.items()}
+        owners_configs = {name: val for sets in config["projects"].get("owners") or [] for name, val in sets.items()}
+        return team_configs, override_configs, owners_configs
+
+    def _config_usernames(self, team_configs: dict, override_configs: dict, owners_configs: dict) -> set[str]:
+        usernames = set()
+        for info in team_configs.values():
+            usernames.update(self._team_usernames(info))
+        for val in override_configs.values():
+            usernames.update(_strip(val.get("reviewers")))
+        for rules in owners_configs.values():
+            for owners in (rules or {}).values():
+                usernames.update(_strip(owners))
+        return usernames
+
+    def _expired_users(self, usernames: set[str], known: dict[str, GitUser | None],
+                       known_at: dict[str, float]) -> set[str]:
+        """Пользователи, которых нужно запросить в Gitlab: новые, не найденные ранее и загруженные раньше TTL."""
+        expires_before = time.time() - self.git.cfg.GITLAB_USER_CACHE_TTL
+        return {name for name in usernames
+                if known.get(name) is None or known_at.get(name, 0) <= expires_before}
+
+    def _resolve_users(self, team_configs: dict, override_configs: dict, owners_configs: dict,
+                       known: dict[str, GitUser | None],
+                       known_at: dict[str, float]) -> tuple[dict[str, GitUser | None], dict[str, float]]:
+        """Запрашивает в Gitlab только новых пользователей, не найденных ранее и с истекшим сроком (TTL)."""
+        usernames = self._config_usernames(team_configs, override_configs, owners_configs)
+        expired = self._expired_users(usernames, known, known_at)
+        resolved = {name: known[name] for name in usernames - expired}
+        resolved_at = {name: known_at[name] for name in resolved}
+
+        now = time.time()
+        fetched = self.git.resolve_users(expired, refresh=expired & known.keys())
+        resolved.update(fetched)
+        resolved_at.update(dict.fromkeys(fetched, now))
+        return resolved, resolved_at
+
+    @staticmethod
+    def _team_usernames(info: dict) -> list[str]:
+        return _strip([*(info.get("members") or []), *(info.get("reviewers") or []),
+                       info.get("lead"), info.get("assignee")])
+
+    @staticmethod
+    def _is_unchanged(info: dict, previous_info: dict | None, usernames: list[str],
+                      resolved: dict, previous_resolved: dict) -> bool:
+        return info == previous_info and all(resolved.get(name) == previous_resolved.get(name) for name in usernames)
+
+    def _create_override(self, name, val, resolved: dict[str, GitUser | None]):
+        users = [resolved.get(rev) for rev in _strip(val.get("reviewers"))]
         try:
             over = Override(name=name,
                             quantity=val.get("quantity", 1),
                             channel=val.get("channel"),
                             components=val.get("components"),
-                            reviewers=users)
+                            reviewers=users,
+                            weights=val.get("weights") or {})
         except Exception as e:
             log.error(f"Ошибка чтения override-блока конфигурации [{name}]. Блок будет пропущен! -> [{e}]")
             return None
         return over
 
-    def _load_team_config(self):
-        team_setup = self.git.config["teams"]
-        self._members = self._load_users(team_setup)
-        self._groups = self._load_teams(team_setup)
-
-        log.debug(f"Результат загрузки пользователей из конфигурации: {self._members}")
-        log.debug(f"Результат загрузки групп из конфигурации: {self._groups}")
-
-    def _load_users(self, team_setup):
+    def _build_owners(self, owners_configs: dict, resolved: dict[str, GitUser | None]) -> ProjectRouter:
+        """Компилирует карты владения путями (projects.owners) в префиксные деревья шаблонов."""
+        router = ProjectRouter()
+        for project, rules in owners_configs.items():
+            ownership = OwnershipMap()
+            for pattern, owners in (rules or {}).items():
+                reviewers = self._get_valid_reviewers(_strip(owners), resolved)
+                if reviewers:
+                    ownership.add(pattern, ReviewerPool(reviewers))
+                else:
+                    log.warning(f"Для шаблона [{pattern}] проекта [{project}] не найдено ни одного владельца")
+            if ownership:
+                router.add(project, ownership)
+        return router
+
+    @staticmethod
+    def _build_members(team_configs: dict, resolved: dict[str, GitUser | None]) -> dict[str, dict]:
         users = {}
-        for setup in team_setup:
-            for team_name, team_info in setup.items():
-                for member in team_info["members"]:
-                    if member not in users:
-                        user_data = self.git.get_user_data(username=member)
-                        if user_data:
-                            users[member] = {"team": team_name, "info": user_data}
+        for team_name, team_info in team_configs.items():
+            for member in team_info["members"]:
+                if member not in users:
+                    user_data = resolved.get(member.strip())
+                    if user_data:
+                        users[member] = {"team": team_name, "info": user_data}
         return users
 
-    def _load_teams(self, team_setup):
-        groups = {}
-        for setup in team_setup:
-            for team_name, team_info in setup.items():
-                valid_reviewers = self._get_valid_reviewers(team_info["reviewers"])
-                if valid_reviewers:
-                    self._process_team(groups, team_name, team_info, valid_reviewers)
-        return groups
-
-    def _process_team(self, groups, team_name, team_info, valid_reviewers):
+    def _build_group(self, team_name, team_info, resolved: dict[str, GitUser | None]) -> Group | None:
+        valid_reviewers = self._get_valid_reviewers(team_info["reviewers"], resolved)
+        if not valid_reviewers:
+            return None
         try:
-            lead = self.git.get_user_data(username=team_info.get("lead"))
+            lead = resolved.get((team_info.get("lead") or "").strip())
+            assignee = resolved.get((team_info.get("assignee") or "").strip())
             channel = team_info.get("channel")
             quantity = team_info.get("quantity") or 1
-            assignee = self._get_assignee(team_info)
 
             group = Group(
                 name=team_name,
                 quantity=quantity,
                 lead=lead,
                 channel=channel,
-                reviewers=valid_reviewers
+                reviewers=valid_reviewers,
+                weights=team_info.get("weights") or {}
             )
 
             if assignee:
                 group.assignee = assignee
 
-            groups[team_name] = group
+            return group
         except pydantic.error_wrappers.ValidationError as e:
             log.error(
                 f"Ошибка в чтении конфигурации на этапе парсинга команды [{team_name}]. Настройки команды не будут учтены! -> [{e}]"
             )
+            return None
 
-    def _get_assignee(self, team_info):
-        assignee_username = team_info.get("assignee")
-        return self.git.get_user_data(username=assignee_username) if assignee_username else None
-
-    def _get_valid_reviewers(self, reviewers):
+    @staticmethod
+    def _get_valid_reviewers(reviewers, resolved: dict[str, GitUser | None]):
         valid_reviewers = []
         for reviewer in reviewers:
-            reviewer_data = self.git.get_user_data(username=reviewer)
+            reviewer_data = resolved.get(reviewer.strip())
             if reviewer_data:
                 valid_reviewers.append(reviewer_data)
             else:
@@ -108,12 +292,24 @@ class Team:
         return valid_reviewers
 
     def _check_project_for_override(self, project: str) -> tuple[bool, Override] | tuple[bool, None]:
-        for over in self._overrides:
-            if project in over.components:
-                return True, over
+        over = self._state.override_router.get(project)
+        if over:
+            return True, over
         return False, None
 
-    def get_random_reviewer_for_user(self, username: str, project: str) -> tuple[list[GitUser], Override] | tuple[list[GitUser], None] | tuple[None, None]:
+    def covers(self, username: str, project: str) -> bool:
+        """Проверяет, может ли быть выбран ревьювер: автор состоит в команде, проект входит в override
+        или для проекта заданы владельцы путей."""
+        return (self._check_project_for_override(project)[0]
+                or self._state.owners_router.get(project) is not None
+                or self.get_user_by_username(username) is not None)
+
+    def get_random_reviewer_for_user(self, username: str, project: str, paths: list[str] | None = None) -> tuple[list[GitUser], Override] | tuple[list[GitUser], None] | tuple[None, None]:
+
+        owners = self._get_reviewers_by_owners(project, paths or [], username)
+        if owners:
+            log.info(f"Ревьюверы для проекта [{project}] выбраны по владельцам измененных путей [{[rev.uname for rev in owners]}]")
+            return owners, None
 
         res, over_group = self._check_project_for_override(project)
 
@@ -136,61 +332,114 @@ class Team:
         else:
             return None, None
 
+    def _get_reviewers_by_owners(self, project: str, paths: list[str], cur_user: str) -> list[GitUser] | None:
+        """По одному ревьюверу на каждое правило projects.owners, совпавшее с измененными путями,
+        но не больше REVIEW_OWNERS_MAX_REVIEWERS."""
+        ownership: OwnershipMap | None = self._state.owners_router.get(project)
+        if not ownership or not paths:
+            return None
+        limit = self.git.cfg.REVIEW_OWNERS_MAX_REVIEWERS
+        selected: dict[str, GitUser] = {}
+        for pool in ownership.match(paths):
+            if len(selected) >= limit:
+                break
+            for rev in pool.select(1, exclude={cur_user.strip(), *selected}, load=self.load):
+                selected[rev.uname] = rev
+        return [rev.copy() for rev in selected.values()]
+
     def _get_random_reviewer_by_override_group(self, over_group: Override, cur_user: str) -> list[GitUser] | None:
         cur_user = cur_user.strip()
 
         if not over_group or not cur_user:
             return None
 
-        #used_over = [over for over in self._overrides if over.name == over_group.name]
-        available_reviewers = [reviewer for reviewer in over_group.reviewers if reviewer.uname != cur_user]
+        pool = self._state.override_pools[over_group.name]
+        available = pool.available(exclude={cur_user})
 
-        if not available_reviewers:
+        if not available:
             return None
 
-        if len(available_reviewers) < over_group.quantity:
+        quantity = over_group.quantity
+        if available < quantity:
             log.warning(f"Количество ревьюверов [{over_group.quantity}] для исключения (override) [{over_group.name}] "
-                        f"больше доступных пользователей [{len(available_reviewers)}]. Будет выбран один ревьювер!")
+                        f"больше доступных пользователей [{available}]. Будет выбран один ревьювер!")
+            quantity = 1
 
-            reviewers = random.sample(available_reviewers, 1)
-        else:
-            reviewers = random.sample(available_reviewers, over_group.quantity)
-
-        return [rev for rev in reviewers]
+        reviewers = pool.select(quantity, exclude={cur_user}, load=self.load)
+        return [rev.copy() for rev in reviewers]
 
     def _get_random_reviewer(self, cur_user: dict) -> list[GitUser] | None:
 
         if not cur_user:
             return None
 
-        available_reviewers: list[GitUser] = [reviewer for reviewer in self._groups[cur_user["team"]].reviewers if
-                                              reviewer.uname != cur_user["info"].uname]
+        pool = self._state.group_pools[cur_user["team"]]
+        available = pool.available(exclude={cur_user["info"].uname})
 
-        if not available_reviewers:
+        if not available:
             log.error("Невозможно выбрать ревьювера. Нет доступных разработчиков")
             return None
 
-        quantity = self._groups[cur_user["team"]].quantity
-        if len(available_reviewers) < quantity:
+        quantity = self._state.groups[cur_user["team"]].quantity
+        if available < quantity:
             log.warning(f"Количество ревьюверов [{quantity}] для команды [{cur_user['team']}] "
-                        f"больше доступных пользователей [{len(available_reviewers)}]. Будет назначен один ревьювер!")
-
-            r = random.sample(available_reviewers, 1)
-        else:
-            r = random.sample(available_reviewers, self._groups[cur_user["team"]].quantity)
-
-        return [rev for rev in r]
+                        f"больше доступных пользователей [{available}]. Будет назначен один ревьювер!")
+            quantity = 1
+
+        r = pool.select(quantity, exclude={cur_user["info"].uname}, load=self.load)
+        return [rev.copy() for rev in r]
+
+    def record_assignment(self, project_id: int, mr_id: int, reviewers: list[GitUser]):
+        # При DEBUG_REVIEWER_ID MR назначается на отладочного пользователя, выбранные ревьюверы нагрузку не получают
+        if self.load is not None and not self.git.cfg.DEBUG_REVIEWER_ID:
+            self.load.assign(project_id, mr_id, [rev.id for rev in reviewers])
+
+    def release_reviews(self, project_id: int, mr_id: int) -> int:
+        return self.load.release(project_id, mr_id) if self.load is not None else 0
+
+    def reconcile_load(self):
+        """Сверяет счетчики открытых ревью с Gitlab по всем ревьюверам конфигурации: команд, override и владельцев
+        путей (projects.owners). Сверка заменяет все счетчики, поэтому пропущенный ревьювер получил бы нулевую нагрузку."""
+        if self.load is None:
+            return
+        state = self._state
+        user_ids = {rev.id for group in state.groups.values() for rev in group.reviewers}
+        user_ids.update(rev.id for over in state.overrides if over for rev in over.reviewers)
+        user_ids.update(rev.id for ownership in state.owners_router.values()
+                        for pool in ownership.owners() for rev in pool.reviewers)
+        open_reviews = self.git.list_open_reviews(sorted(user_ids))
+        self.load.reconcile(open_reviews)
+        log.info(f"Нагрузка ревьюверов сверена с Gitlab: {len(user_ids)} ревьюверов, {len(open_reviews)} открытых ревью")
+
+    def usernames(self) -> set[str]:
+        """Возвращает username всех пользователей конфигурации, найденных в Gitlab."""
+        return {user.uname for user in self._state.resolved.values() if user}
 
     def get_user_by_username(self, name: str) -> dict | None:
         if name.strip():
             try:
-                user = self._members[name]
+                user = self._state.members[name]
                 return user
             except KeyError:
                 return None
 
     def get_team(self, name: str) -> Group | None:
         if name.strip():
-            return self._groups[name]
+            return self._state.groups.get(name)
         else:
             return None
+
+    def get_review_team(self, name: str | None, reviewers: list[GitUser], override: Override | None) -> Group:
+        """Команда MR для уведомлений: команда автора. Если автор не состоит в командах (ревьюверы выбраны
+        по override или владельцам путей) - блок override, команда первого ревьювера или группа из самих ревьюверов."""
+        team = self.get_team(name) if name else None
+        if team:
+            return team
+        if override:
+            return Group(name=override.name, quantity=override.quantity, channel=override.channel,
+                         reviewers=override.reviewers)
+        for rev in reviewers:
+            member = self._state.members.get(rev.uname)
+            if member and member["team"] in self._state.groups:
+                return self._state.groups[member["team"]]
+        return Group(name="owners", quantity=len(reviewers), reviewers=reviewers)
@@ -0,0 +1,85 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Collection, Iterable
+
+import gitlab
+from gitlab.exceptions import GitlabError
+from loguru import logger as log
+
+from reviewer.utilites import TTLCache, MISSING
+from .schemas import GitUser
+
+
+class UserDirectory:
+    """Справочник пользователей Gitlab с кэшированием по username."""
+
+    def __init__(self, gl: gitlab.client.Gitlab, ttl: int, maxsize: int, concurrency: int):
+        self._gl = gl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, name="gitlab_users")
+        self._concurrency = max(concurrency, 1)
+        self.hits = 0
+        self.misses = 0
+
+    def _fetch(self, username: str) -> GitUser | None:
+        self.misses += 1
+        user = self._gl.users.list(username=username)
+
+        if user and user[0].state == "active":
+            return GitUser(id=user[0].id,
+                           name=user[0].name,
+                           uname=user[0].username,
+                           avatar_url=user[0].avatar_url,
+                           web_url=user[0].web_url)
+        return None
+
+    def resolve(self, usernames: Iterable[str], refresh: Collection[str] = ()) -> dict[str, GitUser | None]:
+        """Загружает в кэш всех переданных пользователей, запрашивая Gitlab только для отсутствующих
+        и перечисленных в refresh.
+
+        Пользователи, которых не удалось запросить из-за ошибки Gitlab, в результат не попадают.
+        """
+        unique = {name.strip() for name in usernames if name and name.strip()}
+        resolved = {}
+        for name in unique - set(refresh):
+            user = self._cache.get(name)
+            if user is not MISSING:
+                self.hits += 1
+                resolved[name] = user.copy() if user else None
+        missing = [name for name in unique if name not in resolved]
+        failed = 0
+
+        if missing:
+            log.debug("Запрос данных {} пользователей в Gitlab (параллельно: {})", len(missing), self._concurrency)
+            with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+                for start in range(0, len(missing), self._concurrency):
+                    batch = missing[start:start + self._concurrency]
+                    futures = [pool.submit(contextvars.copy_context().run, self._safe_fetch, name) for name in batch]
+                    for name, user in zip(batch, (future.result() for future in futures)):
+                        if user is MISSING:
+                            failed += 1
+                            continue
+                        self._cache.set(name, user)
+                        resolved[name] = user.copy() if user else None
+
+        if failed:
+            log.warning(f"Не удалось получить из Gitlab данные {failed} пользователей, они будут запрошены повторно")
+        return resolved
+
+    def seed(self, users: dict[str, GitUser | None]):
+        """Заполняет кэш готовыми данными пользователей, например из снимка конфигурации."""
+        for name, user in users.items():
+            self._cache.set(name, user)
+
+    def _safe_fetch(self, username: str) -> GitUser | None:
+        try:
+            return self._fetch(username)
+        except GitlabError as ex:
+            log.error(f"Ошибка получения данных пользователя [{username}] из Gitlab -> [{ex}]")
+            return MISSING
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
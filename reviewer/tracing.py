@@ -0,0 +1,197 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from datetime import datetime
+
+from loguru import logger as log
+
+# Служебные эндпоинты не трассируются
+UNTRACED_PATHS = frozenset({"/health", "/ready", "/metrics", "/stats", "/admin/profile"})
+
+_sentry = False
+_exporter: "OtlpFileExporter | None" = None
+_otlp_span: contextvars.ContextVar["_ActiveSpan | None"] = contextvars.ContextVar("otlp_span", default=None)
+
+
+class TailSampler:
+    """Решение о сохранении трейса после его завершения: ошибки и медленные трейсы (дольше slow_threshold сек)
+    сохраняются всегда, быстрые успешные - с вероятностью rate."""
+
+    # Статусы транзакций Sentry, означающие ошибку сервиса. Ответы 4xx (unauthenticated, not_found и т.п.)
+    # к ошибкам не относятся и отбираются как успешные
+    ERROR_STATUSES = frozenset({"internal_error", "unknown_error"})
+
+    def __init__(self, rate: float, slow_threshold: float):
+        self.rate = rate
+        self.slow_threshold = slow_threshold
+
+    def keep(self, duration: float, error: bool) -> bool:
+        return error or duration >= self.slow_threshold or random.random() < self.rate
+
+    def sentry_traces_sampler(self, context: dict) -> float:
+        """Сбор спанов включен для всех запросов, кроме служебных: отбор выполняет before_send_transaction."""
+        path = (context.get("asgi_scope") or {}).get("path")
+        return 0.0 if path in UNTRACED_PATHS else 1.0
+
+    def sentry_before_send_transaction(self, event: dict, hint: dict) -> dict | None:
+        started, finished = event.get("start_timestamp"), event.get("timestamp")
+        duration = _seconds(finished) - _seconds(started) if started and finished else 0.0
+        status = ((event.get("contexts") or {}).get("trace") or {}).get("status")
+        return event if self.keep(duration, status in self.ERROR_STATUSES) else None
+
+
+def _seconds(timestamp) -> float:
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    return float(timestamp)
+
+
+class _ActiveSpan:
+    __slots__ = ("spans", "data", "failed")
+
+    def __init__(self, spans: list, data: dict):
+        self.spans = spans
+        self.data = data
+        self.failed = False
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class OtlpFileExporter:
+    """Записывает трейсы в файл в формате OTLP/JSON: одна строка ExportTraceServiceRequest на трейс.
+
+    Файл читается OpenTelemetry Collector (receiver otlpjsonfile) и может быть передан в Jaeger/Tempo.
+    """
+
+    SPAN_KIND_INTERNAL = 1
+    SPAN_KIND_SERVER = 2
+    SPAN_KIND_CLIENT = 3
+    STATUS_ERROR = 2
+
+    def __init__(self, path: str, sampler: TailSampler, service_name: str = "team-manager"):
+        self._path = path
+        self._sampler = sampler
+        self._lock = threading.Lock()
+        self._resource = {"attributes": [_attribute("service.name", service_name),
+                                         _attribute("process.pid", os.getpid())]}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def span(self, name: str, op: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        parent = _otlp_span.get()
+        data = {"traceId": parent.data["traceId"] if parent else os.urandom(16).hex(),
+                "spanId": os.urandom(8).hex(),
+                "parentSpanId": parent.data["spanId"] if parent else "",
+                "name": name,
+                "kind": kind,
+                "startTimeUnixNano": str(time.time_ns()),
+                "attributes": [_attribute("op", op), *(_attribute(k, v) for k, v in attributes.items())]}
+        active = _ActiveSpan(parent.spans if parent else [], data)
+        token = _otlp_span.set(active)
+        try:
+            yield active
+        except BaseException:
+            active.failed = True
+            raise
+        finally:
+            _otlp_span.reset(token)
+            data["endTimeUnixNano"] = str(time.time_ns())
+            if active.failed:
+                data["status"] = {"code": self.STATUS_ERROR}
+            active.spans.append(data)
+            if parent is None:
+                self._finish(active)
+
+    def _finish(self, root: _ActiveSpan):
+        duration = (int(root.data["endTimeUnixNano"]) - int(root.data["startTimeUnixNano"])) / 1e9
+        failed = any(span.get("status") for span in root.spans)
+        if not self._sampler.keep(duration, failed):
+            return
+        line = json.dumps({"resourceSpans": [{"resource": self._resource,
+                                              "scopeSpans": [{"scope": {"name": "reviewer"}, "spans": root.spans}]}]},
+                          ensure_ascii=False)
+        try:
+            with self._lock, open(self._path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as ex:
+            log.error(f"Ошибка записи трейса в {self._path} -> [{ex}]")
+
+
+def init_tracing(dsn: str | None, sample_rate: float, slow_threshold: float, otlp_file: str | None):
+    global _sentry, _exporter
+    sampler = TailSampler(rate=sample_rate, slow_threshold=slow_threshold)
+    if dsn:
+        import sentry_sdk
+
+        sentry_sdk.init(
+            dsn=dsn,
+            traces_sampler=sampler.sentry_traces_sampler,
+            before_send_transaction=sampler.sentry_before_send_transaction,
+        )
+        _sentry = True
+    if otlp_file:
+        _exporter = OtlpFileExporter(otlp_file, sampler)
+        log.info(f"Трейсы записываются в {otlp_file} (OTLP/JSON)")
+
+
+def mark_failed():
+    """Отмечает текущий трейс как завершившийся ошибкой без исключения (например, ответ 5xx или неотправленное
+    уведомление): спан OTLP и транзакцию Sentry."""
+    if _sentry:
+        import sentry_sdk
+
+        sentry_transaction = sentry_sdk.Hub.current.scope.transaction
+        if sentry_transaction is not None:
+            sentry_transaction.set_status("internal_error")
+    active = _otlp_span.get()
+    if active is not None:
+        active.failed = True
+
+
+@contextmanager
+def span(op: str, name: str, **attributes):
+    """Вложенный спан текущего трейса (Sentry и/или OTLP-файл). Вне трейса спан не создается."""
+    if not _sentry and (_exporter is None or _otlp_span.get() is None):
+        yield
+        return
+    with ExitStack() as stack:
+        if _sentry:
+            import sentry_sdk
+
+            stack.enter_context(sentry_sdk.start_span(op=op, description=name))
+        if _exporter is not None and _otlp_span.get() is not None:
+            kind = OtlpFileExporter.SPAN_KIND_CLIENT if op.startswith("http") else OtlpFileExporter.SPAN_KIND_INTERNAL
+            stack.enter_context(_exporter.span(name, op, kind, **attributes))
+        yield
+
+
+@contextmanager
+def transaction(op: str, name: str, sentry: bool = True, **attributes):
+    """Корневой спан фоновой операции: загрузки конфигурации, отправки уведомления, HTTP-запроса (только OTLP,
+    транзакции запросов в Sentry создает интеграция FastAPI)."""
+    if not _sentry and _exporter is None:
+        yield
+        return
+    with ExitStack() as stack:
+        if _sentry and sentry:
+            import sentry_sdk
+
+            stack.enter_context(sentry_sdk.Hub(sentry_sdk.Hub.current))
+            stack.enter_context(sentry_sdk.start_transaction(op=op, name=name))
+        if _exporter is not None:
+            kind = OtlpFileExporter.SPAN_KIND_SERVER if op.startswith("http") else OtlpFileExporter.SPAN_KIND_INTERNAL
+            stack.enter_context(_exporter.span(name, op, kind, **attributes))
+        yield
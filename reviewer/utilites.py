@@ -1,17 +1,90 @@
 import os
-import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
 
 from jinja2 import Environment, FileSystemLoader
 from jinja2.exceptions import TemplateNotFound
 from loguru import logger as log
 
+from .metrics import CACHE_REQUESTS
+
+MISSING = object()
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+_templates = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True, auto_reload=True)
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограниченным временем жизни записей. Кэш с именем учитывается в метриках."""
+
+    def __init__(self, maxsize: int, ttl: float, name: str | None = None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._name = name
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    if self._name:
+                        CACHE_REQUESTS.labels(self._name, "hit").inc()
+                    return value
+                del self._data[key]
+            self.misses += 1
+            if self._name:
+                CACHE_REQUESTS.labels(self._name, "miss").inc()
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+def precompile_templates() -> int:
+    """Компилирует все шаблоны заранее. Повторная компиляция произойдет только при изменении файла шаблона."""
+    names = _templates.list_templates(extensions=["j2"])
+    for name in names:
+        _templates.get_template(name)
+    return len(names)
+
 
 def render_template(template_filename: str, context: dict) -> str | None:
     try:
-        templates_dir = os.path.join(os.path.abspath(sys.path[0]), "templates")
-        env = Environment(loader=FileSystemLoader(templates_dir), autoescape=True)
-
-        template = env.get_template(template_filename)
+        template = _templates.get_template(template_filename)
         output_from_parsed_template = template.render(context)
         return output_from_parsed_template
     except TemplateNotFound:
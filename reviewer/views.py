@@ -1,90 +1,191 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, Header
-from gitlab.v4.objects import ProjectMergeRequest
-from gitlab.v4.objects.projects import Project
+import asyncio
+import hmac
+import os
+import time
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, HTTPException, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
 from loguru import logger as log
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import Required
 from starlette import status
 
-from .app import init_config, msg_queue
-from .app_services import get_team_service, get_git_service
-from .schemas import MrSetupAnswer
-from .services import TeamService, GitService
-from .teams.schemas import GitUser, MrCrResultData, Group, Override
+from . import metrics
+from .app import init_config, outbox, dispatcher, readiness, git, bot, config_sync, metrics_state, profiler
+from .app_services import get_review_service
+from .logs import throttled
+from .profiling import track_timings, server_timing_header
+from .schemas import MrSetupAnswer, DeadLetter, ReviewBatchRequest
+from .services import ReviewService
 
 api_router = APIRouter()
 
 
-@api_router.get('/health', status_code=status.HTTP_200_OK)
-def perform_healthcheck():
-    return {'healthcheck': 'Everything OK!'}
-
-
-@api_router.get('/review', response_model=MrSetupAnswer, response_model_exclude_none=True)
-async def set_review(mr_id: int = Query(default=Required), project_id: int = Query(default=Required),
-                     team_service: TeamService = Depends(get_team_service),
-                     git_service: GitService = Depends(get_git_service),
-                     apikey: str | None = Header(default=None)):
+def _authorize(apikey: str | None):
     if init_config.AUTH_TOKEN and apikey != init_config.AUTH_TOKEN.strip():
-        log.error("Ошибка авторизации!")
+        throttled.error("Ошибка авторизации!")
         raise HTTPException(status_code=401, detail="Unauthorized")
-    log.info(f"Получен запрос на настройку код-ревью для MR {mr_id}, project {project_id}")
 
-    mr: ProjectMergeRequest
-    project: Project
-    mr, project = git_service.get_mr(mr_id=mr_id, project_id=project_id)
 
-    if not mr:
-        log.error("Ошибка загрузки MR")
-        raise HTTPException(status_code=404, detail=f"MR {mr_id} в проекте {project_id} не найден")
+def _authorize_admin(apikey: str | None):
+    if not init_config.AUTH_TOKEN:
+        log.error("Административные методы недоступны: не задан AUTH_TOKEN")
+        raise HTTPException(status_code=403, detail="AUTH_TOKEN не задан")
+    _authorize(apikey)
 
-    mr_ref = mr.references["full"]
-    log.debug(mr)
-    log.debug(project)
 
-    if len(mr.reviewers) > 0:
-        log.error("Повторный запрос на установку code-review пропущен")
-        raise HTTPException(status_code=204, detail="Pass")
+def _profile_response() -> PlainTextResponse:
+    session = profiler.session
+    return PlainTextResponse(profiler.folded(), headers={"X-Profile-Pid": str(session["pid"]),
+                                                         "X-Profile-Samples": str(session["samples"])})
 
-    if 'NoCodeReview' in mr.labels:
-        log.info(f"MR [{mr_ref}] пропущен в соответствии с действующими исключениями фильтрами")
-        log.warning(f"Для MR {mr_id} в проекте {project_id} установлен флаг 'NoCodeReview'")
-        raise HTTPException(status_code=204, detail="Pass")
 
-    diffs = git_service.get_commit_info(mr)
-    log.debug(diffs)
+def _authorize_webhook(token: str | None):
+    secret = (init_config.GITLAB_WEBHOOK_TOKEN or "").strip()
+    if not secret or not hmac.compare_digest((token or "").encode(), secret.encode()):
+        throttled.error("Ошибка авторизации вебхука Gitlab!")
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
-    if git_service.check_project_exceptions(project.path_with_namespace) or diffs.count() == 0:
-        log.info(f"MR [{mr_ref}] пропущен в соответствии с действующими исключениями фильтрами")
-        raise HTTPException(status_code=204, detail="Pass")
 
-    log.debug(f"По запрошенному MR с учетом фильтров найдено {diffs.count()} изменений")
+@api_router.get('/health', status_code=status.HTTP_200_OK)
+def perform_healthcheck():
+    return {'healthcheck': 'Everything OK!'}
 
-    reviewers, override_group = team_service.get_random_reviewer_for_user(mr.author["username"],
-                                                                        project.path_with_namespace)
 
-    if len(reviewers) == 0:
-        log.warning(f"Для MR [{mr_ref}] не удалось выбрать ревьювера")
-        raise HTTPException(status_code=204, detail="Pass")
+@api_router.get('/ready')
+def perform_readiness_check():
+    state = readiness.state()
+    return JSONResponse(state, status_code=status.HTTP_200_OK if state["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE)
 
-    log.info(f"Для MR [{mr_ref}] выбран ревьювер {reviewers}")
 
-    if init_config.DEBUG_MR_SETUP:
-        raise HTTPException(status_code=200, detail="DEBUG_MR_SETUP=true")
+@api_router.get('/metrics')
+def get_metrics():
+    return Response(metrics.render(metrics_state), media_type=CONTENT_TYPE_LATEST)
 
-    user: dict = team_service.get_user_by_username(mr.author['username'])
-    team: Group = team_service.get_team(user["team"])
 
-    set_mr_setting_result: MrCrResultData = git_service.set_mr_review_setting(reviewers,
-                                                                              user["info"],
-                                                                              team,
-                                                                              override_group,
-                                                                              mr,
-                                                                              project, diffs)
-    if not set_mr_setting_result:
-        log.error("Ошибка сохранения значений для MR")
-        raise HTTPException(status_code=500, detail="Ошибка сохранения значений для MR")
+@api_router.get('/stats')
+def get_stats(apikey: str | None = Header(default=None)):
+    _authorize(apikey)
+    return {
+        "http": {"gitlab": git.session.stats(), "mattermost": bot.session.stats()},
+        "cache": {"gitlab_users": git.users.stats(), "mattermost": bot.cache_stats()},
+    }
 
-    log.debug(f"Result -> {set_mr_setting_result}")
-    msg_queue.put(set_mr_setting_result)
-    mr_answer = MrSetupAnswer.parse_obj(set_mr_setting_result)
-    return mr_answer
+
+@api_router.get('/review', response_model=MrSetupAnswer, response_model_exclude_none=True)
+async def set_review(response: Response,
+                     mr_id: int = Query(default=Required), project_id: int = Query(default=Required),
+                     review_service: ReviewService = Depends(get_review_service),
+                     apikey: str | None = Header(default=None)):
+    _authorize(apikey)
+    if not readiness.ready:
+        raise HTTPException(status_code=503, detail="Сервис не готов к обработке запросов")
+    throttled.info("Получен запрос на настройку код-ревью для MR {}, project {}", mr_id, project_id)
+    timings = track_timings() if profiler.server_timing else None
+    started = time.perf_counter()
+    try:
+        answer = await review_service.review(project_id=project_id, mr_id=mr_id)
+    except HTTPException as ex:
+        if timings is not None:
+            ex.headers = {**(ex.headers or {}),
+                          "Server-Timing": server_timing_header(timings, time.perf_counter() - started)}
+        raise
+    finally:
+        profiler.request_done()
+    if timings is not None:
+        response.headers["Server-Timing"] = server_timing_header(timings, time.perf_counter() - started)
+    return answer
+
+
+@api_router.post('/review/batch')
+async def set_review_batch(request: ReviewBatchRequest,
+                           review_service: ReviewService = Depends(get_review_service),
+                           apikey: str | None = Header(default=None)):
+    _authorize(apikey)
+    if not readiness.ready:
+        raise HTTPException(status_code=503, detail="Сервис не готов к обработке запросов")
+    items = await review_service.collect_batch(request)
+    return StreamingResponse(review_service.review_batch(items), media_type="application/x-ndjson")
+
+
+@api_router.post('/admin/profile', response_class=PlainTextResponse)
+async def run_profile(seconds: float = Query(default=10, gt=0, le=300),
+                      requests: int = Query(default=0, ge=0),
+                      interval: float = Query(default=0.01, ge=0.001, le=1),
+                      server_timing: bool = Query(default=True),
+                      idle: bool = Query(default=False),
+                      apikey: str | None = Header(default=None)):
+    _authorize_admin(apikey)
+    if not profiler.start(seconds, requests, interval, server_timing, idle):
+        raise HTTPException(status_code=409, detail="Профилирование уже запущено")
+    log.warning(f"Запущено профилирование воркера {os.getpid()}: {seconds} сек, запросов {requests or '-'}")
+    while profiler.active:
+        await asyncio.sleep(0.1)
+    log.warning(f"Профилирование воркера {os.getpid()} завершено, снято {profiler.session['samples']} срезов")
+    return _profile_response()
+
+
+@api_router.get('/admin/profile', response_class=PlainTextResponse)
+def get_profile(apikey: str | None = Header(default=None)):
+    _authorize_admin(apikey)
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="Профилирование не запускалось")
+    if profiler.active:
+        raise HTTPException(status_code=409, detail="Профилирование еще не завершено")
+    return _profile_response()
+
+
+@api_router.get('/outbox/dead', response_model=list[DeadLetter])
+def get_dead_letters(limit: int = Query(default=100, le=1000), apikey: str | None = Header(default=None)):
+    _authorize_admin(apikey)
+    return outbox.dead_letters(limit)
+
+
+@api_router.post('/outbox/dead/{dead_id}/replay', status_code=status.HTTP_202_ACCEPTED)
+def replay_dead_letter(dead_id: int, apikey: str | None = Header(default=None)):
+    _authorize_admin(apikey)
+    item_id = outbox.replay(dead_id)
+    if item_id is None:
+        raise HTTPException(status_code=404, detail=f"Dead letter {dead_id} не найден")
+    dispatcher.notify()
+    log.info(f"Уведомление {dead_id} из dead letters возвращено в очередь отправки")
+    return {"id": item_id}
+
+
+@api_router.post('/webhook/gitlab', status_code=status.HTTP_202_ACCEPTED)
+async def gitlab_webhook(request: Request, background_tasks: BackgroundTasks,
+                         review_service: ReviewService = Depends(get_review_service),
+                         x_gitlab_token: str | None = Header(default=None),
+                         x_gitlab_event: str | None = Header(default=None)):
+    _authorize_webhook(x_gitlab_token)
+    try:
+        event = await request.json()
+    except ValueError:
+        event = None
+    if not isinstance(event, dict):
+        throttled.warning("Получено событие Gitlab с некорректным телом ({})", x_gitlab_event)
+        raise HTTPException(status_code=400, detail="Тело события должно быть JSON-объектом")
+    if x_gitlab_event == "Push Hook" and git.is_config_push(event):
+        config_sync.request_refresh()
+        log.info(f"Получено событие изменения конфигурации команд ({event.get('checkout_sha')})")
+        return {"status": "reload"}
+
+    if x_gitlab_event == "Merge Request Hook":
+        # Некорректное событие не отклоняется с 4xx: Gitlab отключает вебхук после серии ошибок
+        mr = review_service.mr_event_ref(event)
+        if mr is None:
+            throttled.warning("Событие MR без target_project_id или iid пропущено")
+            return {"status": "ignored", "reason": "нет target_project_id или iid"}
+        if await review_service.release_reviews(event, mr):
+            return {"status": "released"}
+        if not readiness.ready:
+            raise HTTPException(status_code=503, detail="Сервис не готов к обработке запросов")
+        reason = review_service.check_mr_event(event)
+        if reason:
+            throttled.debug("Событие MR {}, project {} пропущено -> [{}]", mr.mr_id, mr.project_id, reason)
+            return {"status": "ignored", "reason": reason}
+        throttled.info("Получено событие MR {}, project {}", mr.mr_id, mr.project_id)
+        background_tasks.add_task(review_service.review_in_background, mr.project_id, mr.mr_id, event.get("project"))
+        return {"status": "accepted"}
+
+    return {"status": "ignored"}
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+import pytest
+
+from reviewer.teams.schemas import GitUser, MrCrResultData, MrDiffList
+
+
+@pytest.fixture
+def make_result():
+    """Фабрика результатов настройки ревью (полезная нагрузка уведомления outbox)."""
+
+    def make(mr_id: int = 1, reviewer: str = "reviewer", channel: str | None = None) -> MrCrResultData:
+        web_url = "https://git.example.com/group/project"
+        return MrCrResultData(review_team="team", review_lead=None, review_channel=channel,
+                              project_name=f"group/project!{mr_id}", project_id=1, web_url=web_url,
+                              source_branch="feature", target_branch="master", mr_assignee=None,
+                              mr_reviewers=[GitUser(id=2, name=reviewer, uname=reviewer)],
+                              mr_reviewer_avatar=f"{web_url}/avatar.png", mr_reviewer_url=web_url,
+                              mr_author=GitUser(id=1, name="author", uname="author"),
+                              mr_author_avatar=f"{web_url}/avatar.png", mr_author_url=web_url,
+                              mr_id=str(mr_id), mr_url=f"{web_url}/-/merge_requests/{mr_id}", mr_title="MR",
+                              mr_diffs=MrDiffList(), created_at=datetime.now(), updated_at=datetime.now())
+
+    return make
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+from reviewer.idempotency import ReviewLedger, SingleFlight
+from reviewer.schemas import ReviewOutcome
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return ReviewLedger(path=str(tmp_path / "reviews.sqlite3"), ttl=60, skip_ttl=0.2, lease=60)
+
+
+def test_first_request_takes_lease_and_repeated_waits(ledger):
+    assert ledger.begin(1, 1) == (True, None)
+    assert ledger.begin(1, 1) == (False, None)
+    assert ledger.begin(1, 2) == (True, None)
+
+
+def test_completed_review_is_replayed_until_ttl(ledger):
+    ledger.begin(1, 1)
+    ledger.complete(1, 1, ReviewOutcome(status=200, answer='{"mr_id": 1}'))
+    owner, outcome = ledger.begin(1, 1)
+    assert owner is False
+    assert outcome == ReviewOutcome(status=200, answer='{"mr_id": 1}')
+
+
+def test_skipped_review_expires_after_skip_ttl(ledger):
+    ledger.begin(1, 1)
+    ledger.complete(1, 1, ReviewOutcome(status=204, detail="Pass"))
+    assert ledger.begin(1, 1) == (False, ReviewOutcome(status=204, detail="Pass"))
+    time.sleep(0.25)
+    assert ledger.begin(1, 1) == (True, None)
+
+
+def test_server_error_releases_lease(ledger):
+    ledger.begin(1, 1)
+    ledger.complete(1, 1, ReviewOutcome(status=500, detail="error"))
+    assert ledger.begin(1, 1) == (True, None)
+
+
+def test_release_keeps_saved_result(ledger):
+    ledger.begin(1, 1)
+    ledger.complete(1, 1, ReviewOutcome(status=200, answer="{}"))
+    ledger.release(1, 1)
+    assert ledger.begin(1, 1)[0] is False
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "reviews.sqlite3")
+    crashed = ReviewLedger(path=path, ttl=60, lease=0.2)
+    other = ReviewLedger(path=path, ttl=60, lease=0.2)
+    assert crashed.begin(1, 1) == (True, None)
+    assert other.begin(1, 1) == (False, None)
+    time.sleep(0.25)
+    assert other.begin(1, 1) == (True, None)
+    assert crashed.begin(1, 1) == (False, None)
+
+
+def test_single_flight_joins_concurrent_calls():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return results, len(flight)
+
+    results, in_flight = asyncio.run(main())
+    assert results == [1] * 5
+    assert calls == 1
+    assert in_flight == 0
@@ -0,0 +1,97 @@
+import sqlite3
+from collections import Counter
+
+import pytest
+
+from reviewer.teams.load import ReviewLoad, ReviewerPool
+from reviewer.teams.schemas import GitUser
+
+
+def user(user_id: int) -> GitUser:
+    return GitUser(id=user_id, name=f"user{user_id}", uname=f"user{user_id}")
+
+
+@pytest.fixture
+def load(tmp_path):
+    return ReviewLoad(path=str(tmp_path / "review-load.sqlite3"))
+
+
+def test_assign_and_release_counts(load):
+    load.assign(1, 1, [10, 11])
+    load.assign(1, 1, [10])
+    load.assign(1, 2, [10])
+    assert load.stats() == {10: 2, 11: 1}
+    assert load.release(1, 1) == 2
+    assert load.stats() == {10: 1, 11: 0}
+    assert load.release(1, 1) == 0
+
+
+def test_reconcile_replaces_counts(load):
+    load.assign(1, 1, [10, 11])
+    load.reconcile([(12, 1, 5), (12, 1, 6), (12, 1, 6)])
+    assert load.count(10) == 0
+    assert load.count(12) == 2
+
+
+def test_refresh_picks_up_other_writers_only(load, tmp_path):
+    generation = load.generation
+    load.assign(1, 1, [10])
+    load.refresh()
+    assert load.generation == generation
+
+    conn = sqlite3.connect(str(tmp_path / "review-load.sqlite3"), isolation_level=None)
+    conn.execute("INSERT INTO review_load (user_id, project_id, mr_id) VALUES (11, 1, 2)")
+    load.refresh()
+    assert load.generation == generation + 1
+    assert load.count(11) == 1
+
+
+def test_pool_selects_least_loaded(load):
+    pool = ReviewerPool([user(10), user(11), user(12)])
+    load.assign(1, 1, [10, 11])
+    assert [rev.id for rev in pool.select(1, load=load)] == [12]
+
+
+def test_pool_weight_divides_load(load):
+    pool = ReviewerPool([user(10), user(11)], weights={"user10": 4})
+    # user10: (3 + 1) / 4 = 1, user11: (1 + 1) / 1 = 2
+    load.assign(1, 1, [10])
+    load.assign(1, 2, [10])
+    load.assign(1, 3, [10])
+    load.assign(1, 4, [11])
+    assert [rev.id for rev in pool.select(1, load=load)] == [10]
+
+
+def test_pool_excludes_author_and_spreads_consecutive_assignments(load):
+    pool = ReviewerPool([user(10), user(11), user(12)])
+    picks = []
+    for mr_id in range(6):
+        selected = pool.select(1, exclude={"user12"}, load=load)
+        load.assign(1, mr_id, [rev.id for rev in selected])
+        picks.extend(rev.id for rev in selected)
+    assert Counter(picks) == {10: 3, 11: 3}
+
+
+def test_pool_breaks_ties_randomly():
+    pool = ReviewerPool([user(10), user(11), user(12)])
+    first = Counter(pool.select(1)[0].id for _ in range(300))
+    assert set(first) == {10, 11, 12}
+
+
+def test_pool_rebuilds_after_release(load):
+    pool = ReviewerPool([user(10), user(11)])
+    load.assign(1, 1, [10])
+    load.assign(1, 2, [10])
+    load.assign(1, 3, [11])
+    assert [rev.id for rev in pool.select(1, load=load)] == [11]
+    load.release(1, 1)
+    load.release(1, 2)
+    assert [rev.id for rev in pool.select(1, load=load)] == [10]
+
+
+def test_pool_select_is_capped_by_pool_size(load):
+    pool = ReviewerPool([user(10), user(11)])
+    selected = pool.select(5, load=load)
+    assert sorted(rev.id for rev in selected) == [10, 11]
+    assert len(pool) == 2
+    assert pool.available(exclude={"user10"}) == 1
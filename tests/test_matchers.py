@@ -0,0 +1,72 @@
+import pytest
+
+from reviewer.teams.matchers import PathPatternTrie, SkipMatcher, ProjectRouter, OwnershipMap
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("docs", False),
+    ("docs/readme.md", True),
+    ("docs/api/index.md", True),
+    ("src/docs/readme.md", False),
+])
+def test_skip_dir_double_star_matches_only_directory_contents(path, expected):
+    assert SkipMatcher(patterns=["docs/**"]).match(path) is expected
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("build", False),
+    ("build/app.bin", True),
+    ("src/build/app.bin", True),
+])
+def test_skip_unanchored_directory_matches_at_any_depth(path, expected):
+    assert SkipMatcher(patterns=["build/"]).match(path) is expected
+
+
+def test_skip_extensions_files_and_patterns():
+    matcher = SkipMatcher(extensions=[".BPMN", "tar.gz"], files=[".gitlab-ci.yml"], patterns=["*.lock"])
+    assert matcher.match("process/flow.bpmn")
+    assert matcher.match("dist/app.tar.gz")
+    assert matcher.match(".gitlab-ci.yml")
+    assert matcher.match("poetry.lock")
+    assert matcher.match("sub/dir/yarn.lock")
+    assert not matcher.match("sub/.gitlab-ci.yml")
+    assert not matcher.match("src/main.py")
+
+
+def test_trie_middle_double_star_matches_zero_or_more_segments():
+    trie = PathPatternTrie()
+    trie.add("src/**/test_*.py", "tests")
+    assert trie.match("src/test_a.py") == ["tests"]
+    assert trie.match("src/a/b/test_a.py") == ["tests"]
+    assert trie.match("lib/test_a.py") == []
+
+
+def test_trie_returns_values_in_insertion_order():
+    trie = PathPatternTrie()
+    trie.add("*.py", "first")
+    trie.add("src/", "second")
+    trie.add("src/*.py", "third")
+    assert trie.match("src/main.py") == ["first", "second", "third"]
+
+
+def test_project_router_exact_path_wins_over_deepest_group():
+    router = ProjectRouter()
+    router.add("group/*", "group")
+    router.add("group/sub/*", "sub")
+    router.add("group/sub/project", "exact")
+    router.add("group/sub/*", "duplicate")
+    assert router.get("group/sub/project") == "exact"
+    assert router.get("Group/Sub/Other") == "sub"
+    assert router.get("group/other") == "group"
+    assert router.get("other/project", "default") == "default"
+    assert sorted(router.values()) == ["exact", "group", "sub"]
+
+
+def test_ownership_last_matching_rule_wins_and_rules_ordered_by_matched_paths():
+    ownership = OwnershipMap()
+    ownership.add("*", "all")
+    ownership.add("api/", "api")
+    ownership.add("web/", "web")
+    assert ownership.match(["api/a.py"]) == ["api"]
+    assert ownership.match(["web/a.js", "api/a.py", "api/b.py", "README.md"]) == ["api", "web", "all"]
+    assert ownership.owners() == ["all", "api", "web"]
@@ -0,0 +1,112 @@
+import sqlite3
+import time
+
+import pytest
+
+from reviewer.outbox import Outbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(path=str(tmp_path / "outbox.sqlite3"), max_attempts=3, backoff_base=0, backoff_max=0, lease=60)
+
+
+def test_claim_returns_items_in_order_up_to_limit(outbox, make_result):
+    ids = [outbox.put(make_result(mr_id=i)) for i in range(5)]
+    claimed = outbox.claim(limit=3)
+    assert [item.id for item in claimed] == ids[:3]
+    assert claimed[0].payload.mr_id == "0"
+    assert claimed[0].attempts == 0
+
+
+def test_claimed_item_is_leased_until_lease_expires(tmp_path, make_result):
+    outbox = Outbox(path=str(tmp_path / "outbox.sqlite3"), max_attempts=3, backoff_base=0, backoff_max=0, lease=0.2)
+    item_id = outbox.put(make_result())
+    assert [item.id for item in outbox.claim()] == [item_id]
+    assert outbox.claim() == []
+    time.sleep(0.25)
+    assert [item.id for item in outbox.claim()] == [item_id]
+
+
+def test_ack_removes_item(outbox, make_result):
+    outbox.put(make_result())
+    outbox.ack(outbox.claim()[0].id)
+    assert outbox.depth() == 0
+    assert outbox.next_attempt_in() is None
+
+
+def test_fail_schedules_retry_with_backoff_and_keeps_delivery_flags(tmp_path, make_result):
+    outbox = Outbox(path=str(tmp_path / "outbox.sqlite3"), max_attempts=3, backoff_base=30, backoff_max=60)
+    outbox.put(make_result(channel="channel"))
+    item = outbox.claim()[0]
+    item.reviewers_sent = True
+    assert outbox.fail(item, "group message failed") is False
+    assert outbox.claim() == []
+    # Задержка первой попытки - от половины до полного backoff_base
+    assert 14 <= outbox.next_attempt_in() <= 30
+    assert outbox.depth() == 1
+
+
+def test_retry_preserves_sent_parts(outbox, make_result):
+    outbox.put(make_result(channel="channel"))
+    item = outbox.claim()[0]
+    item.reviewers_sent = True
+    outbox.fail(item, "group message failed")
+    retried = outbox.claim()[0]
+    assert retried.attempts == 1
+    assert retried.reviewers_sent is True
+    assert retried.group_sent is False
+
+
+def test_item_moves_to_dead_letters_after_max_attempts(outbox, make_result):
+    outbox.put(make_result(mr_id=7))
+    for attempt in range(1, 4):
+        item = outbox.claim()[0]
+        assert outbox.fail(item, f"error {attempt}") is (attempt == 3)
+    assert outbox.depth() == 0
+    assert outbox.dead_count() == 1
+    dead = outbox.dead_letters()[0]
+    assert dead.attempts == 3
+    assert dead.last_error == "error 3"
+    assert dead.payload.mr_id == "7"
+
+
+def test_replay_returns_dead_letter_with_delivery_flags(outbox, make_result):
+    outbox.put(make_result(channel="channel"))
+    for _ in range(3):
+        item = outbox.claim()[0]
+        item.reviewers_sent = True
+        outbox.fail(item, "group message failed")
+    dead = outbox.dead_letters()[0]
+    assert dead.reviewers_sent is True
+
+    assert outbox.replay(dead.id) is not None
+    assert outbox.dead_count() == 0
+    replayed = outbox.claim()[0]
+    assert replayed.attempts == 0
+    assert replayed.reviewers_sent is True
+    assert replayed.group_sent is False
+
+
+def test_replay_unknown_dead_letter(outbox):
+    assert outbox.replay(100) is None
+
+
+def test_migrates_tables_without_delivery_flags(tmp_path, make_result):
+    path = str(tmp_path / "outbox.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL,
+                             attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL,
+                             created_at REAL NOT NULL, last_error TEXT);
+        CREATE TABLE dead_letters (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL,
+                                   attempts INTEGER NOT NULL, last_error TEXT, created_at REAL NOT NULL,
+                                   failed_at REAL NOT NULL);
+    """)
+    conn.close()
+    outbox = Outbox(path=path, max_attempts=1, backoff_base=0, backoff_max=0)
+    outbox.put(make_result())
+    item = outbox.claim()[0]
+    item.reviewers_sent = True
+    assert outbox.fail(item, "error") is True
+    assert outbox.dead_letters()[0].reviewers_sent is True